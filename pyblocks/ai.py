@@ -0,0 +1,304 @@
+# A computer player for pyblocks, licensed under GPLv3
+#
+# For every new piece each reachable column and rotation is tried with the
+# game's own landing and cascade rules. The best few are
+# then looked at again with every placement of the next piece on top of them.
+# Boards are evaluated once and kept in a transposition table keyed by their
+# Zobrist hash, so the boards the lookahead saw are free when the next piece
+# comes along.
+#
+# The board is scanned once per piece. A placement that collapses something is
+# played on the board itself and taken back afterwards, and its value comes from
+# the columns and cells the cascade touched. The lookahead stops once another
+# move would take it past its time budget, so on large boards a piece is still
+# chosen within a frame.
+
+from collections import OrderedDict
+from math import floor
+from timeit import default_timer
+from board import EMPTY
+
+lost = -1e9
+
+class Shape:
+    # The column heights and touching same colored blocks of a board, and the sums
+    # its value is made of, so a placement is valued from the columns it changes.
+    def __init__(self, heights, pairs, y_edge):
+        self.heights = heights
+        self.pairs = pairs
+        self.y_edge = y_edge
+        self.squares = sum([height * height for height in heights])
+        self.bumps = sum([abs(heights[x] - heights[x+1]) for x in range(len(heights) - 1)])
+        self.top = max(heights)
+
+    def changed(self, changes, pairs):
+        # A new shape with the heights moved by changes, which maps columns to the
+        # blocks they gained or lost.
+        heights = self.heights[:]
+        for x, change in changes.items():
+            heights[x] += change
+        return Shape(heights, pairs, self.y_edge)
+
+    def value(self, changes, pairs):
+        # Low and even stacks are good, blocks of the same color next to each other
+        # are runs waiting to happen. A stack near the top is worst of all.
+        heights = self.heights
+        width = len(heights)
+        squares, bumps, top = self.squares, self.bumps, self.top
+        shrunk = False
+        for x, change in changes.items():
+            height = heights[x] + change
+            squares += height * height - heights[x] * heights[x]
+            top = max(top, height)
+            shrunk = shrunk or (change < 0 and heights[x] == self.top)
+        for x in set([x for x in changes if x > 0] + [x + 1 for x in changes if x + 1 < width]):
+            left, right = heights[x-1], heights[x]
+            bumps += abs(left + changes.get(x-1, 0) - right - changes.get(x, 0)) - abs(left - right)
+        if shrunk:
+            top = max([heights[x] + changes.get(x, 0) for x in range(width)])
+
+        value = -4. * squares / width
+        value -= 20. * bumps
+        value -= 1000. * max(0, top - (self.y_edge - 6))
+        return value + 30. * pairs
+
+class Player:
+    def __init__(self, lookahead=True, beam=4, budget=0.015, table_size=50000):
+        # budget is in seconds, None lets the lookahead look at every move of the
+        # beam however long it takes.
+        self.lookahead = lookahead
+        self.beam = beam
+        self.budget = budget
+        self.table_size = table_size
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.piece = None
+
+    def keys(self, state):
+        # The key presses that play the current piece, chosen once when it appears.
+        # The piece is dropped as fast as it goes.
+        if state.piece is self.piece:
+            return ['DOWN']
+        self.piece = state.piece
+        column, rotation = self.choose(state)
+        dir = ['LEFT', 'RIGHT'][column > state.piece.x]
+        return ['UP'] * rotation + [dir] * abs(column - state.piece.x) + ['DOWN']
+
+    def __call__(self, state, rng=None):
+        # Works as a policy for simulate.py.
+        return self.choose(state)
+
+    def choose(self, state):
+        # Returns the (column, rotation) to play the current piece with.
+        start = default_timer()
+        piece = state.piece
+        board = state.board
+        heights, pairs = self.features(board)
+        shape = Shape(heights, pairs, board.y_edge)
+        candidates = self.placements(board, shape, piece.colors, piece.x, int(floor(piece.y)) + 3, state.spawn_x)
+        if not candidates:
+            return piece.x, 0
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+        if self.lookahead:
+            # The value of a move is what it scores now plus the best the next piece
+            # can do from the board it leaves behind. A move is expected to take as
+            # long as the longest search so far, and the moves left out keep their value.
+            search = default_timer() - start
+            refined = []
+            for value, score, (column, rotation) in candidates[:self.beam]:
+                now = default_timer()
+                if self.budget is not None and now - start + search > self.budget:
+                    break
+                if value > lost:
+                    colors = piece.colors[rotation:] + piece.colors[:rotation]
+                    score, over, changes, pairs, undo = self.play(board, shape, column, colors, state.spawn_x)
+                    if not over:
+                        after = shape.changed(changes, pairs)
+                        value = score + self.best_placement(board, after, state.next_piece.colors, state.spawn_x)
+                    self.take_back(board, undo)
+                refined.append((value, score, (column, rotation)))
+                search = max(search, default_timer() - now)
+            candidates = refined + candidates[len(refined):]
+            candidates.sort(key=lambda candidate: -candidate[0])
+
+        return candidates[0][2]
+
+    def placements(self, board, shape, colors, x, row, spawn_x):
+        # Every (value, score, (column, rotation)) the piece can be dropped as,
+        # starting from column x with its bottom at row. Every drop is valued by
+        # putting the piece on the board and taking it off again, without copying
+        # the board.
+        data = board.data
+        heights = shape.heights
+        results = []
+        for column in self.reachable(board, x, row):
+            top = board.y_edge - heights[column] - 3
+            seen = set()
+            for rotation in range(len(colors)):
+                rotated = colors[rotation:] + colors[:rotation]
+                if tuple(rotated) in seen:
+                    continue
+                seen.add(tuple(rotated))
+
+                if top < 0 or (column == spawn_x and top <= 2):
+                    results.append((lost, 0, (column, rotation)))
+                    continue
+
+                key = board.hash
+                for i, color in enumerate(rotated):
+                    data[top+i][column] = color
+                    key ^= board.zobrist[top+i][column][color]
+                collapses = False
+                added = 0
+                for i, color in enumerate(rotated):
+                    if board.makes_run(column, top+i, color):
+                        collapses = True
+                        break
+                    added += data[top+i+1][column] == color
+                    added += column > 0 and data[top+i][column-1] == color
+                    added += column + 1 < board.x_edge and data[top+i][column+1] == color
+                for i in range(len(rotated)):
+                    data[top+i][column] = EMPTY
+
+                if collapses:
+                    score, over, changes, pairs, undo = self.play(board, shape, column, rotated, spawn_x)
+                    if over:
+                        results.append((lost, 0, (column, rotation)))
+                    else:
+                        value = self.lookup(board.hash)
+                        if value is None:
+                            value = shape.value(changes, pairs)
+                            self.store(board.hash, value)
+                        results.append((score + value, score, (column, rotation)))
+                    self.take_back(board, undo)
+                    continue
+
+                value = self.lookup(key)
+                if value is None:
+                    value = shape.value({column: 3}, shape.pairs + added)
+                    self.store(key, value)
+                results.append((value, 0, (column, rotation)))
+        return results
+
+    def reachable(self, board, x, row):
+        # A piece moves sideways only past columns that are still empty at its bottom.
+        columns = [x]
+        for dir in [-1, 1]:
+            column = x + dir
+            while 0 <= column < board.x_edge and board.get_color(column, row) == EMPTY:
+                columns.append(column)
+                column += dir
+        return columns
+
+    def play(self, board, shape, column, colors, spawn_x):
+        # Lands the piece on the board itself like GameState.land() does. Returns
+        # the score, whether the game would be over, the changes to the column
+        # heights, the pairs after the cascade and what take_back() needs to undo
+        # it all.
+        undo = (board.changed_cells, board.combo, [], [])
+        board.changed_cells = set(board.changed_cells)
+        cells = board.add_piece(column, board.y_edge - shape.heights[column] - 3, colors)
+        if cells is None:
+            return 0, True, None, 0, undo
+        undo[2].extend(cells)
+        steps = board.resolve_cascade()
+        undo[3].extend(steps)
+
+        # Only the cells the piece and the cascade touched can change the heights
+        # and pairs. What they held before is found by undoing the cascade on a
+        # dictionary instead of the board.
+        score = 0
+        changes = {column: len(colors)}
+        touched = [cell for cell, color in cells]
+        before = {}
+        for step in steps:
+            for points, center in step.scores:
+                score += points
+            for (x, y), color in step.removed:
+                changes[x] = changes.get(x, 0) - 1
+                touched.append((x, y))
+            for start, end, color in step.moves:
+                touched.append(start)
+                touched.append(end)
+        for step in reversed(steps):
+            for start, end, color in reversed(step.moves):
+                before[end] = EMPTY
+                before[start] = color
+            for cell, color in step.removed:
+                before[cell] = color
+        for cell, color in cells:
+            before[cell] = EMPTY
+        pairs = shape.pairs + self.touching(board, touched, before)
+        return score, board.data[2][spawn_x] != EMPTY, changes, pairs, undo
+
+    def take_back(self, board, (changed_cells, combo, cells, steps)):
+        for step in reversed(steps):
+            for (x, y), (to_x, to_y), color in reversed(step.moves):
+                board.remove_block(to_x, to_y)
+                board.add_block(x, y, color)
+            for (x, y), color in step.removed:
+                board.add_block(x, y, color)
+        for (x, y), color in cells:
+            board.remove_block(x, y)
+        board.changed_cells = changed_cells
+        board.combo = combo
+
+    def touching(self, board, cells, before):
+        # How many more pairs of touching same colored blocks with at least one of
+        # them in cells the board has than it had with the colors in before.
+        data = board.data
+        sides = set()
+        for (x, y) in cells:
+            sides.update([(x-1, y, 1, 0), (x, y, 1, 0), (x, y-1, 0, 1), (x, y, 0, 1)])
+        pairs = 0
+        for x, y, dx, dy in sides:
+            if x < 0 or y < 0 or x + dx >= board.x_edge or y + dy >= board.y_edge:
+                continue
+            color, other = data[y][x], data[y+dy][x+dx]
+            if color != EMPTY and color == other:
+                pairs += 1
+            color, other = before.get((x, y), color), before.get((x + dx, y + dy), other)
+            if color != EMPTY and color == other:
+                pairs -= 1
+        return pairs
+
+    def best_placement(self, board, shape, colors, spawn_x):
+        key = (board.hash, tuple(colors))
+        value = self.lookup(key)
+        if value is None:
+            value = lost
+            for candidate in self.placements(board, shape, colors, spawn_x, 2, spawn_x):
+                value = max(value, candidate[0])
+            self.store(key, value)
+        return value
+
+    def features(self, board):
+        # The height of every column and the number of touching same colored blocks.
+        data = board.data
+        heights = [board.y_edge - board.get_bottom(x) for x in range(board.x_edge)]
+        pairs = 0
+        for x in range(board.x_edge):
+            for y in range(board.y_edge - heights[x], board.y_edge):
+                color = data[y][x]
+                if data[y+1][x] == color:
+                    pairs += 1
+                if x + 1 < board.x_edge and data[y][x+1] == color:
+                    pairs += 1
+        return heights, pairs
+
+    def lookup(self, key):
+        try:
+            value = self.table.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.table[key] = value
+        self.hits += 1
+        return value
+
+    def store(self, key, value):
+        if len(self.table) >= self.table_size:
+            self.table.popitem(last=False)
+        self.table[key] = value
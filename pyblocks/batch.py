@@ -0,0 +1,257 @@
+# Many boards of pyblocks stepped at once with NumPy, licensed under GPLv3
+#
+# Usage: python batch.py [options]
+# All boards live in one (boards, height, width) array and every landing is a
+# handful of whole-array operations, whatever the number of boards. After a
+# landing only the neighbours of the landed cells are looked at, and the few
+# boards where they make a run are searched in full: by comparing the array
+# with itself shifted one and two cells along each of the collapse directions,
+# joining the blocks of crossing runs into groups by passing the highest label
+# along the links between them, and letting gravity be a stable sort of every
+# column that puts the empty cells on top.
+#
+# The rules and the scores are the ones of Board, which --verify checks by
+# playing the same pieces on both. Pieces are dropped straight into their
+# column, as if the player could always steer them there. NumPy is needed for
+# this module only, the game itself runs without it.
+
+import sys, time
+from optparse import OptionParser
+from board import Board, EMPTY, colors, collapse_dirs
+from gamestate import parse_size, classic_size
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Boards are padded with this many cells of a value that's no color, so every
+# shift used below is a view into the padded copy instead of a new array.
+border = 2
+no_color = 255
+
+def padded(a, fill):
+    result = numpy.empty(a.shape[:-2] + (a.shape[-2] + 2*border, a.shape[-1] + 2*border), a.dtype)
+    result.fill(fill)
+    result[..., border:-border, border:-border] = a
+    return result
+
+def shifted(p, dx, dy):
+    # The padded p seen from dx, dy away: result[..., y, x] is p's cell y+dy, x+dx.
+    height, width = p.shape[-2] - 2*border, p.shape[-1] - 2*border
+    return p[..., border+dy:border+dy+height, border+dx:border+dx+width]
+
+def landed_runs(boards, columns, tops, length):
+    # Whether any of the length cells landed in columns from tops down is part of
+    # a run, like Board.makes_run() for each of them. Before the landing the
+    # boards had none, so the boards where this is False need no full search.
+    # The neighbours are picked straight out of a flat padded copy of the boards.
+    count, height, width = boards.shape
+    cells = padded(boards, no_color).reshape(-1)
+    pitch = width + 2*border
+    base = numpy.arange(count) * (height + 2*border) * pitch + (tops + border) * pitch + columns + border
+    found = numpy.zeros(count, bool)
+    for i in range(length):
+        at = base + i * pitch
+        color = cells.take(at)
+        for dx, dy in collapse_dirs:
+            offset = dy * pitch + dx
+            line = numpy.ones(count, numpy.int8)
+            for dir in [offset, -offset]:
+                same = cells.take(at + dir) == color
+                line += same
+                line += same & (cells.take(at + 2*dir) == color)
+            found |= line >= 3
+    return found
+
+def find_runs(boards):
+    # Returns the blocks that are part of a run in any direction, and for every
+    # direction the blocks whose next block along it belongs to the same run.
+    marked = numpy.zeros(boards.shape, bool)
+    links = []
+    filled = boards != EMPTY
+    cells = padded(boards, no_color)
+    flags = numpy.zeros(cells.shape, bool)
+    inside = shifted(flags, 0, 0)
+    for dx, dy in collapse_dirs:
+        same = boards == shifted(cells, dx, dy)
+        inside[...] = filled & same & (boards == shifted(cells, 2*dx, 2*dy))
+        runs = inside | shifted(flags, -dx, -dy) | shifted(flags, -2*dx, -2*dy)
+        inside[...] = runs
+        links.append(runs & shifted(flags, dx, dy) & same)
+        marked |= runs
+    return marked, links
+
+def group_sizes(marked, links):
+    # Only the marked blocks take part. Each starts with its own label, every
+    # linked pair takes the higher of their labels and every label is then
+    # replaced by the label of the block it names, until the labels agree along
+    # every link. A group of touching runs ends up with the label of its last
+    # block. Returns the board and the number of blocks of every group.
+    count, height, width = marked.shape
+    cells = numpy.flatnonzero(marked)
+    firsts = []
+    seconds = []
+    for (dx, dy), link in zip(collapse_dirs, links):
+        first = numpy.flatnonzero(link)
+        firsts.append(first)
+        seconds.append(first + dy * width + dx)
+    first = numpy.searchsorted(cells, numpy.concatenate(firsts))
+    second = numpy.searchsorted(cells, numpy.concatenate(seconds))
+
+    labels = numpy.arange(len(cells))
+    while True:
+        higher = numpy.maximum(labels[first], labels[second])
+        numpy.maximum.at(labels, first, higher)
+        numpy.maximum.at(labels, second, higher)
+        jumped = labels[labels]
+        while (jumped != labels).any():
+            labels = jumped
+            jumped = labels[labels]
+        if (labels[first] == labels[second]).all():
+            break
+
+    groups, sizes = numpy.unique(labels, return_counts=True)
+    return cells[groups] // (height * width), sizes
+
+def compact(boards):
+    # A stable sort on "is filled" keeps the blocks of every column in order and
+    # moves the empty cells above them.
+    order = numpy.argsort(boards != EMPTY, axis=1, kind='mergesort')
+    return numpy.take_along_axis(boards, order, axis=1)
+
+class Batch:
+    def __init__(self, count, width=6, height=18):
+        if numpy is None:
+            raise ImportError("batch.py needs NumPy")
+        self.width, self.height = width, height
+        self.spawn_x = (width - 1) // 2
+        self.boards = numpy.zeros((count, height, width), numpy.uint8)
+        self.scores = numpy.zeros(count, numpy.int64)
+        self.landings = numpy.zeros(count, numpy.int64)
+        self.game_over = numpy.zeros(count, bool)
+
+    def drop(self, columns, pieces):
+        # Lands pieces[i], three colors top down, in columns[i] of every board that's
+        # still playing, like GameState.land() does. Returns the score of every board.
+        playing = numpy.flatnonzero(~self.game_over)
+        columns = columns[playing]
+        pieces = pieces[playing]
+
+        filled = self.boards[playing, :, columns] != EMPTY
+        tops = numpy.where(filled.any(1), filled.argmax(1), self.height) - 3
+        overflow = tops < 0
+        self.game_over[playing[overflow]] = True
+
+        playing, columns, pieces, tops = playing[~overflow], columns[~overflow], pieces[~overflow], tops[~overflow]
+        for i in range(pieces.shape[1]):
+            self.boards[playing, tops + i, columns] = pieces[:, i]
+
+        collapsing = landed_runs(self.boards[playing], columns, tops, pieces.shape[1])
+        scores = self.resolve(playing[collapsing])
+        self.scores += scores
+        self.landings[playing] += 1
+        self.game_over[playing] |= self.boards[playing, 2, self.spawn_x] != EMPTY
+        return scores
+
+    def resolve(self, playing):
+        # Collapses and compacts the boards until none of them has a run left. Every
+        # pass is one more combo, boards drop out as soon as they're done. Only the
+        # boards with a run in them are given.
+        scores = numpy.zeros(len(self.boards), numpy.int64)
+        combo = 0
+        while len(playing):
+            boards = self.boards[playing]
+            marked, links = find_runs(boards)
+            collapsing = marked.reshape(len(playing), -1).any(1)
+            if not collapsing.any():
+                break
+
+            playing, boards, marked = playing[collapsing], boards[collapsing], marked[collapsing]
+            links = [link[collapsing] for link in links]
+
+            owners, sizes = group_sizes(marked, links)
+            points = 300 * (sizes - 2) * (combo + 1) ** 2
+            scores[playing] += numpy.bincount(owners, points, len(playing)).astype(numpy.int64)
+
+            boards[marked] = EMPTY
+            self.boards[playing] = compact(boards)
+            combo += 1
+        return scores
+
+    def board(self, index):
+        board = Board(self.width, self.height)
+        board.data[:self.height] = [list(row) for row in self.boards[index].tolist()]
+        board.hash = board.compute_hash()
+        return board
+
+def verify(count, width, height, landings, seed):
+    # Plays the same pieces on a batch and on Boards and compares every board and score.
+    rng = numpy.random.RandomState(seed)
+    batch = Batch(count, width, height)
+    boards = [Board(width, height) for i in range(count)]
+    scores = [0] * count
+    over = [False] * count
+
+    for landing in range(landings):
+        columns = rng.randint(0, width, count)
+        pieces = rng.randint(1, colors + 1, (count, 3))
+        batch.drop(columns, pieces)
+
+        for i, board in enumerate(boards):
+            if over[i]:
+                continue
+            x = int(columns[i])
+            if board.add_piece(x, board.get_bottom(x) - 3, [int(color) for color in pieces[i]]) is None:
+                over[i] = True
+                continue
+            for step in board.resolve_cascade():
+                for score, center in step.scores:
+                    scores[i] += score
+            over[i] = board.data[2][batch.spawn_x] != EMPTY
+
+    differences = 0
+    for i, board in enumerate(boards):
+        if board.data[:-1] != batch.boards[i].tolist() or scores[i] != batch.scores[i] or over[i] != batch.game_over[i]:
+            differences += 1
+    return differences
+
+def main(argv=None):
+    parser = OptionParser(usage="python batch.py [options]")
+    parser.add_option("-n", "--boards", type="int", default=10000, help="boards played side by side")
+    parser.add_option("--landings", type="int", default=200, help="pieces dropped on every board")
+    parser.add_option("--board-size", default="%dx%d" % classic_size, metavar="WxH", help="board width and height in blocks")
+    parser.add_option("--seed", type="int", default=0, help="seed for the columns and colors of the pieces")
+    parser.add_option("--verify", action="store_true", default=False, help="play the same pieces on Boards too and compare")
+    options, args = parser.parse_args(argv)
+    try:
+        width, height = parse_size(options.board_size)
+    except ValueError, error:
+        parser.error(str(error))
+    if numpy is None:
+        print "NumPy is missing, batch.py can't run without it."
+        sys.exit(1)
+
+    if options.verify:
+        differences = verify(min(options.boards, 1000), width, height, options.landings, options.seed)
+        print "Boards that differ from Board: %d" % differences
+        if differences:
+            sys.exit(1)
+        return
+
+    rng = numpy.random.RandomState(options.seed)
+    batch = Batch(options.boards, width, height)
+    start = time.time()
+    for landing in range(options.landings):
+        if batch.game_over.all():
+            break
+        batch.drop(rng.randint(0, width, options.boards), rng.randint(1, colors + 1, (options.boards, 3)))
+    elapsed = time.time() - start
+
+    landed = batch.landings.sum()
+    print "Boards: %d of %dx%d, %d still playing" % (options.boards, width, height, (~batch.game_over).sum())
+    print "Landings: %d in %.2f seconds, %.0f landings/sec" % (landed, elapsed, landed / max(elapsed, 1e-9))
+    print "Score mean: %.1f, max: %d" % (batch.scores.mean(), batch.scores.max())
+
+if __name__ == "__main__":
+    main()
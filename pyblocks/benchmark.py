@@ -0,0 +1,279 @@
+# Microbenchmarks for the board and rendering hot paths of pyblocks, licensed under GPLv3
+#
+# Usage: python benchmark.py [options]
+# Runs under the SDL dummy video driver, so no window is opened. The boards are
+# synthetic and seeded, so two runs measure exactly the same work. Results are
+# written as JSON, and --compare prints how they differ from an earlier run.
+
+import os
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import sys, time, random, json, platform
+from timeit import default_timer
+from optparse import OptionParser
+
+from board import Board, colors
+from gamestate import GameState, parse_size, classic_size
+from vector2 import Vector2
+from ai import Player
+
+def make_board(kind, seed, width=6, height=18):
+    # Fills the board bottom up with colors that don't form runs, like a board
+    # between two landings would look.
+    rng = random.Random(seed)
+    board = Board(width, height)
+    filled = {
+        "empty": 0,
+        "half": height // 2,
+        "near_game_over": height - 4,
+        "dense": height - 3,
+        }[kind]
+    palette = range(1, colors+1)
+    if kind != "dense":
+        palette = palette[:4]
+
+    for x in range(width):
+        column_height = filled
+        if kind in ["half", "near_game_over"]:
+            column_height = max(0, min(height - 4, filled + rng.randint(-2, 1)))
+        for y in range(height - 1, height - 1 - column_height, -1):
+            choices = [color for color in palette if not board.makes_run(x, y, color)]
+            board.add_block(x, y, rng.choice(choices or palette))
+
+    board.changed_cells = set()
+    return board
+
+board_kinds = ["empty", "half", "near_game_over", "dense"]
+
+def timed(function, setup, calls, repeat=1):
+    # Only the calls are timed, the setup runs outside of the measurement. Calls
+    # that are too fast for the timer are repeated and averaged.
+    times = []
+    for i in range(calls):
+        args = setup(i)
+        start = default_timer()
+        for j in xrange(repeat):
+            function(*args)
+        times.append((default_timer() - start) / repeat)
+    return times
+
+def landing_setup(board, rng, same_color=False):
+    def setup(i):
+        clone = board.copy()
+        x = rng.randrange(clone.x_edge)
+        top = clone.get_bottom(x) - 3
+        if same_color:
+            piece = [rng.randint(1, colors)] * 3
+        else:
+            piece = [rng.randint(1, colors) for j in range(3)]
+        if top >= 0:
+            clone.add_piece(x, top, piece)
+        return clone, x
+    return setup
+
+def board_benchmarks(calls, seed, (width, height)):
+    results = {}
+    for kind in board_kinds:
+        board = make_board(kind, seed, width, height)
+        rng = random.Random(seed)
+
+        landed = landing_setup(board, rng)
+        results["board.check_collapse." + kind] = timed(lambda clone, x: clone.check_collapse(), landed, calls)
+
+        def collapsing(i, landed=landing_setup(board, rng, same_color=True)):
+            clone, x = landed(i)
+            clone.check_collapse()
+            return clone, x
+        results["board.do_collapse." + kind] = timed(lambda clone, x: clone.do_collapse(), collapsing, calls)
+        results["board.resolve_cascade." + kind] = timed(lambda clone, x: clone.resolve_cascade(), landing_setup(board, rng, same_color=True), calls)
+
+        def holes(i):
+            clone = board.copy()
+            for y in range(clone.y_edge):
+                for x in range(clone.x_edge):
+                    if rng.random() < 0.2:
+                        clone.remove_block(x, y)
+            return clone, dict((x, (clone.y_edge - 1, 0)) for x in range(clone.x_edge))
+        results["board.compact_columns." + kind] = timed(lambda clone, columns: clone.compact_columns(columns), holes, calls)
+
+        results["board.get_bottom." + kind] = timed(lambda clone, x: clone.get_bottom(x), lambda i: (board, i % board.x_edge), calls, 100)
+
+        def empty_landing(i):
+            clone = board.copy()
+            x = rng.randrange(clone.x_edge)
+            return clone, x, clone.get_bottom(x) - 3
+        results["board.add_piece." + kind] = timed(lambda clone, x, top: top >= 0 and clone.add_piece(x, top, [1, 2, 3]), empty_landing, calls)
+
+        def touched_down(i):
+            state = GameState(seed + i, width, height)
+            state.board = board.copy()
+            state.retarget(state.piece)
+            state.piece.y = state.piece.target
+            state.piece.terminate = True
+            return state,
+        results["gamestate.land." + kind] = timed(lambda state: state.land(), touched_down, calls)
+
+        # A fresh player every call, so the transposition table doesn't help.
+        def new_piece(i, lookahead=False):
+            state = GameState(seed + i, width, height)
+            state.board = board.copy()
+            return state, Player(lookahead)
+        results["ai.choose." + kind] = timed(lambda state, player: player.choose(state), new_piece, max(1, calls // 10))
+        results["ai.choose.lookahead." + kind] = timed(lambda state, player: player.choose(state), lambda i: new_piece(i, True), max(1, calls // 10))
+
+    return results
+
+def vector_benchmarks(calls):
+    a = Vector2(1.5, 2.5)
+    b = Vector2(0.25, -0.75)
+    results = {}
+    results["vector2.add"] = timed(lambda: a + b, lambda i: (), calls, 100)
+    results["vector2.sub"] = timed(lambda: a - b, lambda i: (), calls, 100)
+    results["vector2.mul"] = timed(lambda: a * 0.5, lambda i: (), calls, 100)
+    def iadd(v):
+        v += b
+    def isub(v):
+        v -= b
+    results["vector2.iadd"] = timed(iadd, lambda i: (Vector2(1, 2),), calls, 100)
+    results["vector2.isub"] = timed(isub, lambda i: (Vector2(1, 2),), calls, 100)
+    results["vector2.get_length"] = timed(lambda: a.get_length(), lambda i: (), calls, 100)
+    return results
+
+def render_benchmarks(calls, seed, (width, height)):
+    try:
+        import pygame
+    except ImportError:
+        print "pygame is missing, skipping the rendering benchmarks."
+        return {}
+
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((800,600), 0, 32)
+
+    import blocks, textclasses
+    from dirtyrects import Screen
+
+    results = {}
+    blocks.block_size = blocks.fit_block_size(width, height)
+    images = blocks.Block_images()
+    state = GameState(seed, width, height)
+    state.board = make_board("dense", seed, width, height)
+    area = blocks.Playing_area(images, state, 300)
+    results["render.update_block_grid"] = timed(area.update_block_grid, lambda i: (), calls)
+
+    def landing(i):
+        x = i % state.board.x_edge
+        return [((x, y), (i + y) % colors + 1) for y in range(3)],
+    results["render.add_blocks"] = timed(lambda cells: (area.add_blocks(cells), area.redraw_cells()), landing, calls)
+
+    block = blocks.Block(images, area, state.piece, active=True)
+    wrapped = Screen(screen)
+    results["render.Block.update"] = timed(block.update, lambda i: (wrapped,), calls)
+
+    # A cross of 41 blocks at once is about as much as a combo gets, the pool is
+    # refilled before every frame so it's always that full.
+    from particles import Particles
+    particles = Particles(seed=seed)
+    tiles = images.get_current()
+    def burst(i):
+        particles.clear()
+        for n in range(41):
+            particles.spawn(300 + n % 6 * 32, 100 + n // 6 * 32, n % colors + 1)
+        return wrapped, 1. / 40
+    results["render.Particles.frame"] = timed(lambda screen, time: (particles.update(time), particles.draw(screen, tiles)), burst, calls)
+
+    font = blocks.font1
+    results["text.render_text.cached"] = timed(lambda: textclasses.render_text("+300", (50, 100, 200), font, 25), lambda i: (), calls, 100)
+    results["text.render_text.uncached"] = timed(lambda text: textclasses.render_text(text, (50, 100, 200), font, 25), lambda i: ("+%d" % (seed * calls + i),), calls)
+
+    class Watched:
+        score = 0
+    watched = Watched()
+    text = textclasses.Variabletext((0, 0), "Score: %d", watched, (50, 100, 200), 20, font, "score")
+    results["text.Variabletext.update.unchanged"] = timed(text.update, lambda i: (wrapped,), calls, 100)
+    def changed(i):
+        watched.score += 10
+        return wrapped,
+    results["text.Variabletext.update.changed"] = timed(text.update, changed, calls)
+    # A long combo chain: three texts float up every frame for as long as it lasts.
+    texts = textclasses.Floating_texts(textclasses.Movingtext, pygame.Rect(200, 0, 192, 576))
+    def chain(i):
+        for n in range(3):
+            texts.add((200 + n * 64, 400), 300 * (n + 1), (50, 100, 200), 25, font, Vector2(0, -1), 75., 1)
+        return wrapped, 1. / 40
+    results["text.Floating_texts.frame"] = timed(texts.update, chain, calls)
+    results["text.Movingtext.create"] = timed(lambda: textclasses.Movingtext((0, 0), 300, (50, 100, 200), 25, font, Vector2(0, -1), 75., 1), lambda i: (), calls)
+
+    return results
+
+def summarize(times):
+    times = sorted(times)
+    return {
+        "calls": len(times),
+        "mean_us": sum(times) / len(times) * 1e6,
+        "median_us": times[len(times) // 2] * 1e6,
+        "min_us": times[0] * 1e6,
+        "p90_us": times[int(len(times) * 0.9)] * 1e6,
+        }
+
+def compare(results, filename, threshold):
+    old = json.load(open(filename))["results"]
+    regressions = 0
+    print "%-44s %10s %10s %8s" % ("benchmark", "old us", "new us", "ratio")
+    for name in sorted(results):
+        if name not in old:
+            continue
+        before, after = old[name]["median_us"], results[name]["median_us"]
+        ratio = after / before if before else 0
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = " REGRESSION"
+            regressions += 1
+        print "%-44s %10.2f %10.2f %7.2fx%s" % (name, before, after, ratio, flag)
+    return regressions
+
+def main(argv=None):
+    parser = OptionParser(usage="python benchmark.py [options]")
+    parser.add_option("-n", "--calls", type="int", default=2000, help="calls per benchmark")
+    parser.add_option("--seed", type="int", default=1, help="seed for the synthetic boards")
+    parser.add_option("--board-size", default="%dx%d" % classic_size, metavar="WxH", help="board width and height in blocks")
+    parser.add_option("-o", "--output", default="benchmark.json", help="where to write the JSON results")
+    parser.add_option("--compare", metavar="FILE", help="earlier results to compare against")
+    parser.add_option("--threshold", type="float", default=0.1, help="slowdown that counts as a regression")
+    parser.add_option("--no-render", action="store_true", default=False, help="skip the pygame benchmarks")
+    options, args = parser.parse_args(argv)
+    try:
+        size = parse_size(options.board_size)
+    except ValueError, error:
+        parser.error(str(error))
+
+    raw = {}
+    raw.update(board_benchmarks(options.calls, options.seed, size))
+    raw.update(vector_benchmarks(options.calls))
+    if not options.no_render:
+        raw.update(render_benchmarks(options.calls, options.seed, size))
+
+    results = dict((name, summarize(times)) for name, times in raw.items())
+    output = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "calls": options.calls,
+        "seed": options.seed,
+        "board_size": "%dx%d" % size,
+        "results": results,
+        }
+    f = open(options.output, "w")
+    json.dump(output, f, indent=1, sort_keys=True)
+    f.close()
+
+    if options.compare:
+        if compare(results, options.compare, options.threshold):
+            sys.exit(1)
+    else:
+        for name in sorted(results):
+            print "%-44s %10.2f us" % (name, results[name]["median_us"])
+        print "Results written to", options.output
+
+if __name__ == "__main__":
+    main()
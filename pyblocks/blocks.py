@@ -42,15 +42,29 @@
 #       Fifth released alpha version, April 17th, 2010
 #
 
-import pygame, random, os, sys, copy
+from timeit import default_timer
+started = default_timer()
+
+import pygame, random, threading
+from collections import OrderedDict
 from pygame.locals import *
 from vector2 import Vector2
-from imgload import load_image
+from imgload import load_image, decode_image, prepare_image, list_images, is_cached
 from textclasses import *
+from gamestate import GameState, parse_size, classic_size, min_size, max_size, tick_rate, tick_time, base_speed
+from timeline import Timeline
+from replay import Recorder
+from profiler import Frame_profiler, Null_profiler
+from dirtyrects import Screen, Dirty_screen
+from particles import Particles
+import netplay, snapshot
+from highscores import Score_list, print_scores, default_file as default_scores
+from ai import Player
+from optparse import OptionParser
 
 block_size = 32
-TIMER = 26
-block_speed = 75.
+default_tile_size = 32
+max_frame_ticks = 10
 textcolor = (50, 100, 200)
 textsize = 20
 
@@ -61,42 +75,21 @@ font2_color = (50, 100, 200)
 font2_speed = 75.
 font2_timer = 1
 font2_size = 25
+font2_heading = Vector2((0,-1))
 
-random.seed()
-pygame.init()
-screen = pygame.display.set_mode((800,600), 0, 32)
-pygame.display.set_caption("PyBlocks alpha-5")
-clock = pygame.time.Clock()
-pygame.time.set_timer(TIMER, 5000)
-
-background = pygame.Surface(screen.get_size())
-background = background.convert()
-background.fill((0,0,0))
-
-class Dummy:
-    pass
-
-Leveldata = Dummy()
-Leveldata.level = block_speed-74
-
-class Player_Entity:
-    def __init__(self):
-        self.score = 0
-
-Plr = Player_Entity()
-
-Texts_strings = ["<- -> Move block", "LSHIFT, LCTRL: Rotate block", "Down arrow: Accelerate", "Up arrow: Rotate block", "P: Pause/unpause game", "+/- : Select tileset", "ESC: Quit"]
-Texts = [Simpletext((500, 50+i*(textsize+2)), text, textcolor, textsize, font1) for i, text in enumerate(Texts_strings)]
-score_text_loc = 50+(len(Texts)+1)*(textsize+2)
-Texts.append(Variabletext((500, score_text_loc), "Score: %d", Plr, textcolor, textsize, font1, "score"))
-Texts.append(Variabletext((45, 50), "PANIC: %d", Leveldata, textcolor, textsize, font1, "level"))
-
-score_text_loc += textsize+2
+key_names = {K_LCTRL: 'LCTRL', K_LSHIFT: 'LSHIFT', K_UP: 'UP', K_LEFT: 'LEFT', K_RIGHT: 'RIGHT'}
 
 class Block_images:
     def __init__(self):
-        self.data = {}
+        self.data = OrderedDict()
+        self.decoded = {}
+        self.decode_lock = threading.Lock()
+        self.keys = []
         self.current_set_num = 0
+        self.cache_size = 3
+        self.prefetch = False
+        self.prefetch_threads = []
+        self.stopped = False
         load_on_startup = ""
         
         try:
@@ -111,6 +104,10 @@ class Block_images:
                     self.keys = line[9:].lstrip().split('; ')
                 elif line.startswith('Load on startup:'):
                     load_on_startup = line[16:].lstrip()
+                elif line.startswith('Tileset cache size:'):
+                    self.cache_size = max(1, int(line[19:]))
+                elif line.startswith('Prefetch tilesets:'):
+                    self.prefetch = line[18:].strip().lower() in ['yes', 'on', 'true', '1']
                     
             f.close()
             if not self.keys:
@@ -132,9 +129,9 @@ class Block_images:
             for index, (name, size) in enumerate(self.keys):
                 if load_on_startup == name:
                     self.current_set_num = self.keys.index((name, size))
-                    self.current_set = self.keys[self.current_set_num][0]
                     
-        self.load_sets()
+        self.current_set = self.keys[self.current_set_num][0]
+        self.current_tiles = None
         
     def next_tileset(self, dir):
         self.current_set_num += dir
@@ -144,386 +141,315 @@ class Block_images:
             self.current_set_num = 0
         
         self.current_set = self.keys[self.current_set_num][0]
+        self.current_tiles = None
         return self.keys[self.current_set_num][1]
         
-    def load_sets(self):
+    def get_current(self):
+        # The neighbours are only prefetched once the current tileset is in, so the
+        # background decoding doesn't slow down the set that's needed right now.
+        if self.current_tiles is None:
+            self.current_tiles = self.get_set(self.current_set)
+            self.prefetch_neighbours()
+        return self.current_tiles
+    
+    def get_set(self, name):
+        # Tilesets are loaded the first time they're shown and kept in a least
+        # recently used cache, so only a few of them are ever in memory.
+        try:
+            tiles = self.data.pop(name)
+        except KeyError:
+            tiles = self.load_set(name)
+            while len(self.data) >= self.cache_size:
+                self.data.popitem(last=False)
+        self.data[name] = tiles
+        return tiles
+        
+    def get_size(self, name):
+        for key, size in self.keys:
+            if key == name:
+                return size
+        
+    def find_files(self, name, size, verbose=True):
         extensions = ['.png', '.jpg', '.gif']
-
-        for (name, size) in self.keys:
-            print "Loading tileset:", name
-            self.data[name] = []
-            
-            for i in range(0,7):
-                for ext in extensions:
-                    file = name + "_" + "t" + str(i) + ext
-                    if os.path.isfile(os.path.join('images', file)):
-                        self.data[name].append(load_image(file))
-                        break
-                else:
-                    if size == block_size:
+        files = []
+        available = list_images()
+        
+        for i in range(0,7):
+            for ext in extensions:
+                file = name + "_" + "t" + str(i) + ext
+                if file in available:
+                    files.append(file)
+                    break
+            else:
+                if size == default_tile_size:
+                    if verbose:
                         print "Using default tile for color number", i
-                        self.data[name].append(load_image("Default" + "_" + "t" + str(i) + ".png"))
-                    else:
+                    files.append("Default" + "_" + "t" + str(i) + ".png")
+                else:
+                    if verbose:
                         print "Cannot replace block size:", size, "with a default block size: 32"
-                        print "Press enter to quit."
-                        raw_input()
-                        exit()
+                    return None
+        
+        return files
+        
+    def load_set(self, name):
+        print "Loading tileset:", name
+        
+        self.decode_lock.acquire()
+        try:
+            decoded = self.decoded.pop(name, None)
+        finally:
+            self.decode_lock.release()
+        
+        if decoded is None:
+            files = self.find_files(name, self.get_size(name))
+            if files is None:
+                print "Press enter to quit."
+                raw_input()
+                self.stop_prefetch()
+                exit()
+            tiles = [load_image(file) for file in files]
+        else:
+            tiles = [prepare_image(image, name=file) for file, image in decoded]
+        
+        # Big boards use smaller tiles than the tileset was drawn for.
+        for index, (image, rect) in enumerate(tiles):
+            if image.get_size() != (block_size, block_size):
+                image = pygame.transform.scale(image, (block_size, block_size))
+                tiles[index] = (image, image.get_rect())
+        return tiles
+        
+    def prefetch_neighbours(self):
+        if not self.prefetch or self.stopped or len(self.keys) < 2:
+            return
+        
+        names = []
+        for dir in [1, -1]:
+            name = self.keys[(self.current_set_num + dir) % len(self.keys)][0]
+            if name not in self.data and name not in self.decoded and name not in names:
+                names.append(name)
+        
+        if names:
+            thread = threading.Thread(target=self.decode_sets, args=(names,))
+            thread.setDaemon(True)
+            thread.start()
+            self.prefetch_threads = [running for running in self.prefetch_threads if running.is_alive()] + [thread]
+    
+    def stop_prefetch(self):
+        # Has to be called before the game quits. A decoding thread that's still
+        # running when the interpreter shuts down dies with a traceback.
+        self.stopped = True
+        for thread in self.prefetch_threads:
+            thread.join()
+        self.prefetch_threads = []
+        
+    def decode_sets(self, names):
+        # Runs in a background thread. Only the file decoding happens here, the
+        # conversion to the display format is left to the main thread. It gives
+        # up after the file it's on once stop_prefetch() is called.
+        for name in names:
+            if self.stopped:
+                return
+            files = self.find_files(name, self.get_size(name), verbose=False)
+            if files is None or all([is_cached(file) for file in files]):
+                continue
+            decoded = []
+            for file in files:
+                if self.stopped:
+                    return
+                decoded.append((file, decode_image(file)))
+            
+            self.decode_lock.acquire()
+            try:
+                self.decoded[name] = decoded
+            finally:
+                self.decode_lock.release()
                     
     
 class Block(pygame.sprite.Sprite):
-    def __init__(self, images, area, speed, active=False):
+    def __init__(self, images, area, piece, active=False):
         pygame.sprite.Sprite.__init__(self)
         
         self.images = images
+        self.area = area
+        self.piece = piece
         self.active = active
         self.sprite = pygame.Surface((block_size, block_size*3), 0, 8)
         self.rect = self.sprite.get_rect()
+        self.draw_rect = self.sprite.get_rect()
         
-        self.colors = [random.randint(1, 6),random.randint(1, 6),random.randint(1, 6)]
-        #self.colors = [1,1,2]
-        self.update_sprite()
-        
-        self.locations = [block_size * x + 200 for x in range(0,6)]
-        self.xpos = 2
-        
-        self.pos = Vector2((self.locations[self.xpos], block_size))
-        self.dir = Vector2((0,1))
-                
-        self.speed = speed
-        self.speedup = False
-        
-        self.area = area
-        self.target = Vector2(self.pos.x, self.area.get_bottom(self.xpos))
-        
-        self.terminate = False
-        
-    def reset_pos(self):
-        self.xpos = 2
-        self.pos = Vector2((self.locations[self.xpos], -block_size))
-        self.dir = Vector2((0,1))
-        self.target = Vector2(self.pos.x, self.area.get_bottom(self.xpos))
+        # The sprite is drawn by the first update().
+        self.colors = None
         
     def update_sprite(self):
+        self.colors = list(self.piece.colors)
         for offset, color in enumerate(self.colors):
-            img, rect = self.images.data[self.images.current_set][color]
+            img, rect = self.images.get_current()[color]
             self.sprite.blit(img, (0, offset*block_size))
-            
-    def rotate(self, dir):
-        if dir == 'LSHIFT':
-            temp = self.colors.pop(0)
-            self.colors.append(temp)
-        elif dir == 'LCTRL':
-            temp = self.colors.pop()
-            self.colors.insert(0,temp)
-            
-        self.update_sprite()
-        
-    def update(self, screen, time):
         
+    def update(self, screen):
+        recolored = self.colors != self.piece.colors
+        if recolored:
+            self.update_sprite()
+            
+        # Only plain numbers and the existing rects are touched, nothing is allocated per frame.
         if self.active:
-            if self.speed > 0:
-                dest_vec = self.target - self.pos
-                dest_dist = dest_vec.get_length()
-                travel_dist = min(dest_dist, time * (self.speed + self.speedup * 250))
-                
-                if travel_dist < 0.5:
-                    self.pos = self.target
-                    self.speed = 0
-                    self.terminate = True
-                else:
-                    self.pos += self.dir * travel_dist
-                    
-            self.rect.topleft = self.pos
-            self.speedup = False
+            self.rect.left = self.area.offset + self.piece.x * block_size
+            self.rect.top = self.piece.y * block_size
             
-            draw_pos = (self.pos.x, self.pos.y-2*block_size)
-            screen.blit(self.sprite, draw_pos)
+            self.draw_rect.left = self.rect.left
+            self.draw_rect.top = self.rect.top - 2*block_size
         else:
-            screen.blit(self.sprite, (400, 50))
+            self.draw_rect.left, self.draw_rect.top = 400, 50
+        drawn = screen.blit(self.sprite, self.draw_rect)
         
-    
-    def move(self, dir):
-        if block.terminate:
-            return
-        
-        x,y = self.pos
-        
-        if dir == 1:
-            if self.xpos > 0:
-                a,b = area.find_loc((self.locations[self.xpos-1], self.pos.y))
-                if area.data[b][a] == 0:
-                    self.xpos -= 1
-            else:
-                return
-            
-        elif dir == 2:
-            if self.xpos < 5:
-                a,b = area.find_loc((self.locations[self.xpos+1], self.pos.y))
-                if area.data[b][a] == 0:
-                    self.xpos += 1
-            else:
-                return
-        
-        self.target = Vector2(self.locations[self.xpos], self.area.get_bottom(self.xpos))
-        self.pos = Vector2((self.locations[self.xpos], y))
+        if recolored:
+            screen.mark_dirty(drawn)
                 
 class Playing_area:
-    def __init__(self, images, player, score_text_loc):
+    def __init__(self, images, state, score_text_loc):
         
-        random.seed()
-        self.x_edge, self.y_edge = 6, 18
+        self.state = state
+        self.board = state.board
+        self.x_edge, self.y_edge = self.board.x_edge, self.board.y_edge
         self.images = images
         self.offset = 200
         self.collapse_delay_timer = 350
         
         self.image = pygame.Surface((block_size * self.x_edge, block_size * self.y_edge))
-        self.paused_image = pygame.Surface((block_size * self.x_edge, block_size * self.y_edge))
+        self.paused_image = None
         
         self.rect = self.image.get_rect()
         self.rect.topleft = (self.offset,0)
         
-        img, dummy = self.images.data[self.images.current_set][0]
-        self.data = []
-        self.player = player
-        self.game_over_flag = False
-        
-        for i in range(self.y_edge):
-            self.data.append([0]*6)
-            
-            for j in range(self.x_edge):
-                self.image.blit(img, (j*block_size, i*block_size))
-                self.paused_image.blit(img, (j*block_size, i*block_size))
-                
-        pauselogo, pause_rect = load_image('paused.png', -1)
-        
-        self.paused_image.blit(pauselogo, (10,280))
-        
-        self.data.append([100]*6)
-        self.bottom = self.image.get_height() - block_size * 3
+        self.pending_cells = {}
+        self.changed_rects = []
+        self.pause_logo = None
+        # No tiles are loaded or drawn before the board is shown for the first time.
+        self.grid_drawn = False
         
         self.score_xbase, self.score_ybase = 480, score_text_loc
-        self.scoretexts = []
-        self.little_scoretexts = []
-        
-        self.collapse_locations = []
+        self.scoretexts = Floating_texts(Vanishingtext)
+        self.little_scoretexts = Floating_texts(Movingtext, self.rect)
+        self.particles = Particles(size=max(2, block_size // 8))
         
         self.reset_scores()
-        self.collapse_delay = False
-        self.debug_counter = 0
     
     def update_pause_image(self):
-        img, dummy = self.images.data[self.images.current_set][0]
+        img, dummy = self.images.get_current()[0]
         self.paused_image = pygame.Surface((block_size * self.x_edge, block_size * self.y_edge))
         for i in range(self.y_edge):
             for j in range(self.x_edge):
                 self.paused_image.blit(img, (j*block_size, i*block_size))
         
-        pauselogo, pause_rect = load_image('paused.png', -1)
-        self.paused_image.blit(pauselogo, (10,280))
-        
-    def get_bottom(self, xpos):
-        for pos, row in enumerate(self.data):
-            if row[xpos] != 0:
-                return pos * block_size - 3 * block_size
+        # The logo is the same for every tileset, so it's only loaded once.
+        if self.pause_logo is None:
+            self.pause_logo = load_image('paused.png', -1)
+        pauselogo, pause_rect = self.pause_logo
+        pause_rect.center = self.paused_image.get_rect().center
+        self.paused_image.blit(pauselogo, pause_rect)
+        
+    def change_tileset(self):
+        self.grid_drawn = False
+        self.paused_image = None
+        
+    def draw_image(self, screen):
+        if not self.grid_drawn:
+            self.update_block_grid()
+        self.redraw_cells()
+        screen.blit(self.image,(self.offset,-2*block_size))
+        for rect in self.changed_rects:
+            screen.mark_dirty(rect.move(self.offset, -2*block_size))
+        self.changed_rects = []
     
-    def update(self, screen, time, clock, paused=False):
+    def update(self, screen, time, paused=False):
         if not paused:
-            if not self.collapse_delay:
-                screen.blit(self.image,(self.offset,-2*block_size))
-            else:
-                self.collapse_delay = False
-                time_elapsed = 0
-                while time_elapsed < self.collapse_delay_timer:
-                    time = clock.tick(40)
-                    time_elapsed += time
-                    screen.blit(self.image,(self.offset,-2*block_size))
-                    self.update_texts(screen, time_passed_secs, self.little_scoretexts)
-                    pygame.display.update()
-                    
-            if self.data[2][2] != 0:
-                self.game_over()
-
+            self.draw_image(screen)
+            self.update_collapsing_blocks(screen, time)
         else:
+            if self.paused_image is None:
+                self.update_pause_image()
             screen.blit(self.paused_image,(self.offset,-2*block_size))
     
-    def update_collapsing_blocks(self):
-        def random_palette():
-            return (random.randint(0,255), random.randint(0,255), random.randint(0,255))
-        
-        self.destroying_sprite = pygame.sprite.Sprite()
-        self.destroying_sprite.set_palette([random_palette()]*255)
+    def update_collapsing_blocks(self, screen, time):
+        self.particles.update(time)
+        self.particles.draw(screen, self.images.get_current())
 
     def update_score_texts(self):
         for offset, text in enumerate(self.scoretexts):
             text.y = self.score_ybase+offset*(textsize+2)
     
-    def update_texts(self, screen, time, texts):
-        if not texts:
-            return
-        
-        for text in texts[:]:
-            if not text.timeout:
-                text.update(screen, time)
-            else:
-                texts.remove(text)
+    def update_texts(self, screen, time):
+        # The score lines move up into the rows of the ones that went away, so a
+        # new line always goes under the last one.
+        count = len(self.scoretexts)
+        self.scoretexts.update(screen, time)
+        if len(self.scoretexts) != count:
+            self.update_score_texts()
+        self.little_scoretexts.update(screen, time)
                 
-    def find_loc(self, (_x, _y)):
-        _x = int(_x)
-        _y = int(_y)
-        
-        x = (_x - self.offset) / block_size
-        y = (_y + 3*block_size) / block_size
-        
-        return x,y
+    def set_cell(self, x, y, color):
+        # The cell is only drawn on the next redraw_cells(), and only the last color counts.
+        self.pending_cells[(x, y)] = color
     
-    def blit_loc(self, x, y, color):
-        x *= block_size
-        y *= block_size
-        
-        try:
-            img, rect = self.images.data[self.images.current_set][color]
-        except KeyError:
-            print "KeyError in Area.blit_loc()"
-            print "Key =", color
-            print "x:", x, "y:", y
-            print
-            print self.data
-            exit()
-            
-        self.image.blit(img, (x,y))
+    def redraw_cells(self):
+        if not self.pending_cells:
+            return
         
-    def add_blocks(self, block):
-        #self.debug_counter += 1
-        #print "Block", self.debug_counter, "landed."
-        x,y = self.find_loc(block.pos)
-        for i in range(0, 3):
-                        
-            self.data[y-i-1][x] = block.colors[2-i]
-            self.blit_loc(x,y-i-1,block.colors[2-i])
+        tiles = self.images.get_current()
+        image = self.image
+        for (x, y), color in self.pending_cells.iteritems():
+            self.changed_rects.append(image.blit(tiles[color][0], (x*block_size, y*block_size)))
+        self.pending_cells = {}
         
-        #print self.data
+    def add_blocks(self, cells):
+        for (x, y), color in cells:
+            self.set_cell(x, y, color)
     
-    def update_block_grid(self):            
-        for row_index, row in enumerate(self.data[:-1]):
+    def update_block_grid(self):
+        # Only needed when the tileset changes, everything else goes through set_cell().
+        tiles = self.images.get_current()
+        image = self.image
+        for row_index, row in enumerate(self.board.data[:-1]):
             for block_index, block in enumerate(row):
-                self.blit_loc(block_index, row_index, block)
+                image.blit(tiles[block][0], (block_index*block_size, row_index*block_size))
+        
+        self.pending_cells = {}
+        self.changed_rects = [image.get_rect()]
+        self.grid_drawn = True
                         
     def reset_scores(self):
         self.lastscores = []
-        self.combo = 0
         
-    def add_block(self, x, y, color):
-        self.data[y][x] = color
-        
-    def remove_block(self, x, y):
-        if self.data[y][x] not in [0, 100]:
-            self.data[y][x] = 0
-    
-    def drop_block(self, x, y):
-        if self.data[y][x] == 100:
-            return
-        
-        _y = y + 1
-        temp = self.data[y][x]
-        if self.data[_y][x] == 0:
-            self.remove_block(x, y)
-            try:
-                while self.data[_y+1][x] == 0:
-                    _y += 1
-            except IndexError:
-                print "_y:", _y, "x:", x
-                print "y limit:", len(self.data), "x limit:", len(self.data[0])
-                exit()
-                
-            self.add_block(x, _y, temp)
-                
-    def game_over(self):
-        print "GAME OVER! Final score:", self.player.score
+    def game_over(self, scores_file, mode):
+        state = self.state
+        print "GAME OVER! Final score:", state.score
+        self.images.stop_prefetch()
+        scores = Score_list(scores_file)
+        scores.add(state.score, state.landings, state.seed, (self.x_edge, self.y_edge), mode, self.images.current_set)
+        print "Best %s games with %s:" % (mode, self.images.current_set)
+        print_scores(scores.best(mode=mode, tileset=self.images.current_set))
+        scores.close()
         exit()
     
-    def check_collapse(self):
-        #print "Starting collapse check."
-        collapse = False
-        self.collapsemap = []
-        for i in range(self.y_edge):
-            self.collapsemap.append([0]*6)
-                            
-        for row_index, row in enumerate(self.data):
-            if row == [0]*6 or row == [100]*6:
-                continue
-                        
-            for xpos in range(len(row)):
-                if row[xpos] != 0:
-                    
-                    for collapse_dir in [[0,1], [-1,1], [1,1], [1,0]]:
-                                                                        
-                        currentx = xpos
-                        currenty = row_index
-                        target = row[xpos]
-                        count = 1
-                        
-                        running = True
-                        while running:
-
-                            if len(row) > currentx+collapse_dir[0] and currentx+collapse_dir[0] >= 0 and len(self.data) > currenty+collapse_dir[1] and currenty+collapse_dir[1] >= 0:
-                                if self.data[currenty+collapse_dir[1]][currentx+collapse_dir[0]] == target:
-                                    count += 1
-                                    currentx += collapse_dir[0]
-                                    currenty += collapse_dir[1]
-                                else:
-                                    running = False
-                            else:
-                                running = False
-                                
-                        if count >= 3:
-                            collapse = True
-                            self.collapse_locations.append(((xpos, row_index), collapse_dir, count))
-                            #print "Found a collapse at", (xpos, row_index), "dir:", collapse_dir, "len:", count
-        
-        
-        def prune_collapse_list():
-            for index1, ((x1,y1), dir1, count1) in enumerate(self.collapse_locations[:]):
-                for index2, ((x2,y2), dir2, count2) in enumerate(self.collapse_locations[:]):
-                    
-                    if ((x1,y1), dir1, count1) == ((x2,y2), dir2, count2):
-                        continue
-                    
-                    _x, _y = x1, y1
-                    for i in range(count1):
-                        if (_x,_y) == (x2,y2) and dir1 == dir2:
-                            if count1 > count2:
-                                pos = index2
-                            else:
-                                pos = index1
-                                
-                            del self.collapse_locations[pos]
-                            return False
-                        
-                        _x += dir1[0]
-                        _y += dir1[1]
-            else:
-                return True
-            
-        if len(self.collapse_locations) > 1:
-            done = False
-            while not done:
-                done = prune_collapse_list()
-                                    
-        return collapse
+    def schedule_landing(self, landing, timeline, done):
+        # Every cascade step stays on screen for collapse_delay_timer milliseconds
+        # before the next one, without holding up the main loop.
+        self.add_blocks(landing.cells)
+        self.reset_scores()
+        for step in landing.steps:
+            timeline.then(lambda step=step: self.play_cascade_step(step), self.collapse_delay_timer / 1000.0)
+        timeline.then(self.build_score_texts)
+        if landing.garbage:
+            # Garbage from the other player lifted the whole board.
+            timeline.then(self.update_block_grid)
+        timeline.then(done)
+        timeline.update(0)
     
-    def do_collapse(self):
-        #print "do_collapse()"
-        #marked_spots = []
-        
-        def add_score(count, (x,y)):
-            score = int((300 * (count - 2)) * ((self.combo+1) ** 2))
-            score = int(round(score / 10.0) * 10)
-
-            self.player.score += score
-            self.collapse_delay = True
-            
-            if self.combo > 0:
-                string = str(self.combo+1) + " combo! +" + str(score)
+    def play_cascade_step(self, step):
+        for score, (x,y) in step.scores:
+            if step.combo > 0:
+                string = str(step.combo+1) + " combo! +" + str(score)
             else:
                 string = "          " + "+" + str(score)
                 
@@ -533,118 +459,319 @@ class Playing_area:
             y -= 2*block_size
             
             self.lastscores.append(string)            
-            self.little_scoretexts.append(Movingtext((x+self.offset,y), score, font2_color, font2_size, font1, Vector2((0,-1)), font2_speed, font2_timer))
+            self.little_scoretexts.add((x+self.offset,y), score, font2_color, font2_size, font1, font2_heading, font2_speed, font2_timer)
         
-        from math import floor
-        
-        for ((x,y), dir, count) in self.collapse_locations:
-            center = floor(count/2.0)
-            center_x, center_y = x + center*dir[0], y + center*dir[1]
-            add_score(count, (center_x, center_y))
-                        
-            for i in range(count):
-                self.remove_block(x, y)
-                x += dir[0]
-                y += dir[1]
-
-        
-        self.collapse_locations = []
-        self.combo += 1
-        
-        for row_index_rev, row in enumerate(reversed(self.data)):
-            if row == [100]*6 or row == [0]*6:
-                continue
-            for block_index, block in enumerate(row):
-                if 1 <= block <= 6:
-                    if self.data[self.y_edge-row_index_rev+1][block_index] == 0:
-                        self.drop_block(block_index, self.y_edge-row_index_rev)
-
-        self.update_block_grid()
+        for (x, y), color in step.removed:
+            self.set_cell(x, y, 0)
+            self.particles.spawn(self.offset + (x + 0.5) * block_size, (y - 1.5) * block_size, color)
+        for (x, y), to, color in step.moves:
+            self.set_cell(x, y, 0)
+        for start, (x, y), color in step.moves:
+            self.set_cell(x, y, color)
         
     def build_score_texts(self):
         if self.lastscores:
             for score in self.lastscores:
-                self.scoretexts.append(Vanishingtext((self.score_xbase, self.score_ybase+len(self.scoretexts)*(textsize+2)), score, textcolor, textsize, font1, 3))
-                    
-NewBlock = Block
-images = Block_images()
-area = Playing_area(images, Plr, score_text_loc)
-block = NewBlock(images, area, block_speed, active=True)
-nextblock = NewBlock(images, area, block_speed)
-paused = False
+                self.scoretexts.add((self.score_xbase, self.score_ybase+len(self.scoretexts)*(textsize+2)), score, textcolor, textsize, font1, 3)
 
-while True:
-    time_passed = clock.tick(40)
-    time_passed_secs = time_passed / 1000.0
-        
+class Opponent_view:
+    # The other player's board in small tiles, redrawn only after their landings.
+    def __init__(self, images, opponent, topleft):
+        self.images = images
+        self.opponent = opponent
+        board = opponent.board
+        self.cell = max(1, min(8, 160 // board.x_edge, 400 // (board.y_edge - 2)))
+        self.image = pygame.Surface((self.cell * board.x_edge, self.cell * (board.y_edge - 2)))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = topleft
+        self.tileset = None
+        
+    def update(self, screen):
+        if self.tileset != self.images.current_set:
+            self.tileset = self.images.current_set
+            self.tiles = [pygame.transform.scale(image, (self.cell, self.cell)) for image, rect in self.images.get_current()]
+            self.opponent.changed = True
+        
+        changed = self.opponent.changed
+        if changed:
+            self.opponent.changed = False
+            for y, row in enumerate(self.opponent.board.data[2:-1]):
+                for x, color in enumerate(row):
+                    self.image.blit(self.tiles[color], (x*self.cell, y*self.cell))
+        
+        drawn = screen.blit(self.image, self.rect)
+        if changed:
+            screen.mark_dirty(drawn)
     
-    if not paused:
-        x,y = area.find_loc(block.pos)
-        if block.terminate:
-            area.add_blocks(block)
-            area.reset_scores()
-            while area.check_collapse():
-                area.do_collapse()
-                time_passed = clock.tick(40)
-                time_passed_secs = time_passed / 1000.0
-                area.update(screen, time_passed_secs, clock)
-                
-            area.build_score_texts()
-            block = copy.copy(nextblock)
-            block.active = True
-            block.reset_pos()
-            
-            nextblock = NewBlock(images, area, block_speed)
-        
-        screen.blit(background,(0,0))
-        area.update(screen, time_passed_secs, clock)
-        block.update(screen, time_passed_secs)
-        nextblock.update(screen, time_passed_secs)
-        for text in Texts:
-            text.update(screen)
-        
-        for texts in [area.scoretexts, area.little_scoretexts]:
-            area.update_texts(screen, time_passed_secs, texts)
-        
-        keys = pygame.key.get_pressed()
-        if keys:
-            if keys[K_DOWN]:
-                block.speedup = True
+def fit_block_size(width, height):
+    # The largest tile size up to 32 pixels that fits the visible part of the
+    # board into the classic 192x576 area on the left of the screen.
+    return max(1, min(default_tile_size, 192 // width, 576 // (height - 2)))
+
+def report_startup(startup):
+    last = started
+    for name, stamp in startup:
+        print "%-12s %8.1f ms" % (name, (stamp - last) * 1000)
+        last = stamp
+    print "%-12s %8.1f ms" % ("total", (last - started) * 1000)
+
+def main(argv=None):
+    global block_size
+    
+    parser = OptionParser(usage="python blocks.py [options]")
+    parser.add_option("--board-size", default="%dx%d" % classic_size, metavar="WxH",
+                      help="board width and height in blocks, from %dx%d up to %dx%d" % (min_size + max_size))
+    parser.add_option("--fps", type="int", default=tick_rate,
+                      help="frames drawn per second, 0 draws as many as possible, the game itself always runs at %d steps per second" % tick_rate)
+    parser.add_option("--no-render", action="store_true", default=False,
+                      help="draw nothing and play the game as fast as possible")
+    parser.add_option("--dirty-rects", action="store_true", default=False,
+                      help="only redraw and push the parts of the screen that changed")
+    parser.add_option("--save", metavar="FILE", default="pyblocks.save",
+                      help="where S saves the game while it's paused, %default by default")
+    parser.add_option("--scores", metavar="FILE", default=default_scores,
+                      help="where the high scores are kept, %default by default")
+    parser.add_option("--resume", metavar="FILE",
+                      help="carry on with a saved game")
+    parser.add_option("--record", metavar="FILE",
+                      help="record the game for replay.py")
+    parser.add_option("--seed", type="int",
+                      help="seed for the block colors, random by default")
+    parser.add_option("--profile-phases", action="store_true", default=False,
+                      help="time every phase of every frame, F3 toggles the overlay and F5 a cProfile capture")
+    parser.add_option("--phase-csv", metavar="FILE",
+                      help="write the phase timings of every frame to FILE, implies --profile-phases")
+    parser.add_option("--ai", action="store_true", default=False,
+                      help="let the computer play")
+    parser.add_option("--host", type="int", metavar="PORT",
+                      help="wait for a second player to connect to PORT, %d is the usual one" % netplay.default_port)
+    parser.add_option("--connect", metavar="HOST[:PORT]",
+                      help="play against the player waiting at HOST, who chooses the seed and the board size")
+    parser.add_option("--startup-benchmark", action="store_true", default=False,
+                      help="print how long it took to get the first frame on the screen and quit")
+    options, args = parser.parse_args(argv)
+    try:
+        width, height = parse_size(options.board_size)
+    except ValueError, error:
+        parser.error(str(error))
+    
+    if options.seed is None:
+        options.seed = random.randrange(2**31)
+    speed = base_speed
+    connection = None
+    resumed = None
+    if options.resume:
+        # A recording has to start from an empty board, and both players of a
+        # network game have to start from the same one.
+        if options.record or options.host is not None or options.connect:
+            parser.error("--resume can't be used with --record, --host or --connect")
+        try:
+            resumed = snapshot.resume(options.resume)
+        except (IOError, ValueError), error:
+            parser.error(str(error))
+        width, height = resumed.board.x_edge, resumed.board.y_edge
+    elif options.host is not None:
+        connection = netplay.host(options.host, options.seed, (width, height), speed)
+    elif options.connect:
+        connection, options.seed, (width, height), speed = netplay.join(options.connect)
+    block_size = fit_block_size(width, height)
+    startup = [("imports", default_timer())]
+    
+    # Only the display is needed to start, the fonts are initialised when the
+    # first text is drawn and the sound and joystick modules are never used.
+    pygame.display.init()
+    if options.dirty_rects:
+        screen = Dirty_screen(pygame.display.set_mode((800,600), 0, 32))
     else:
-        screen.blit(background,(0,0))
-        for text in Texts:
-            text.update(screen)
-        area.update(screen, time_passed_secs, clock, paused=True)
+        screen = Screen(pygame.display.set_mode((800,600), 0, 32))
+    pygame.display.set_caption("PyBlocks alpha-5")
+    startup.append(("display", default_timer()))
+    clock = pygame.time.Clock()
+    if options.no_render:
+        options.fps = 0
+        print "Rendering is off, playing as fast as possible."
     
-    pygame.display.update()
-        
-    for event in pygame.event.get():
-        if not paused:
+    background = pygame.Surface(screen.get_size())
+    background = background.convert()
+    background.fill((0,0,0))
+    
+    if resumed is not None:
+        state = resumed
+    else:
+        state = GameState(options.seed, width, height, speed)
+    recorder = Recorder(options.record, state)
+    
+    Texts_strings = ["<- -> Move block", "LSHIFT, LCTRL: Rotate block", "Down arrow: Accelerate", "Up arrow: Rotate block", "P: Pause/unpause game", "S: Save paused game", "+/- : Select tileset", "ESC: Quit"]
+    Texts = [Simpletext((500, 50+i*(textsize+2)), text, textcolor, textsize, font1) for i, text in enumerate(Texts_strings)]
+    score_text_loc = 50+(len(Texts)+1)*(textsize+2)
+    Texts.append(Variabletext((500, score_text_loc), "Score: %d", state, textcolor, textsize, font1, "score"))
+    Texts.append(Variabletext((45, 50), "PANIC: %d", state, textcolor, textsize, font1, "level"))
+    
+    score_text_loc += textsize+2
+    
+    images = Block_images()
+    if options.startup_benchmark:
+        # Decoding the neighbouring tilesets would only compete for the time
+        # being measured.
+        images.prefetch = False
+    views = []
+    match = None
+    if connection is not None:
+        match = netplay.Match(connection, state)
+        Texts.append(Variabletext((20, 80), "Opponent: %d", match.opponent, textcolor, textsize, font1, "score"))
+        Texts.append(Variabletext((20, 80+textsize+2), "Ping: %d ms", connection, textcolor, textsize, font1, "rtt_ms"))
+        views.append(Opponent_view(images, match.opponent, (20, 80+3*(textsize+2))))
+    area = Playing_area(images, state, score_text_loc)
+    block = Block(images, area, state.piece, active=True)
+    nextblock = Block(images, area, state.next_piece)
+    timeline = Timeline()
+    paused = False
+    player = None
+    mode = "single"
+    if options.ai:
+        player = Player()
+        mode = "ai"
+    if match is not None:
+        mode = "versus"
+    
+    if options.profile_phases or options.phase_csv:
+        profiler = Frame_profiler(font2, options.phase_csv)
+    else:
+        profiler = Null_profiler()
+    startup.append(("setup", default_timer()))
+    
+    def show_next_pieces():
+        block.piece = state.piece
+        nextblock.piece = state.next_piece
+    
+    def step():
+        # One fixed step of the game. The next piece waits at the top while the
+        # collapses are still being shown.
+        state.tick()
+        timeline.update(tick_time)
+        moved = not timeline.busy()
+        if moved and player is not None:
+            for key in player.keys(state):
+                recorder.log("key", key)
+                state.press(key)
+        recorder.tick(moved)
+        if moved:
+            landing = state.update(tick_time)
+            if landing:
+                area.schedule_landing(landing, timeline, show_next_pieces)
+                if match is not None:
+                    match.landed(landing)
+            
+            if pygame.key.get_pressed()[K_DOWN]:
+                recorder.log("key", "DOWN")
+                state.press("DOWN")
+    
+    accumulator = 0.
+    while True:
+        time_passed = clock.tick(options.fps)
+        time_passed_secs = time_passed / 1000.0
+        profiler.start_frame()
+        
+        # The other player's landings are picked up once a frame, paused or not, so
+        # their board stays current and the pings keep getting answered.
+        if match is not None:
+            garbage = match.update()
+            if garbage:
+                recorder.log("garbage", garbage)
+                state.add_garbage(garbage)
+        
+        # The game is stepped as often as the time since the last frame allows, so it
+        # plays the same at any frame rate. A very long frame only catches up on
+        # max_frame_ticks steps and the rest of it is dropped.
+        if paused:
+            steps = 0
+            accumulator = 0.
+        elif options.no_render:
+            steps = tick_rate
+        else:
+            accumulator = min(accumulator + time_passed_secs, max_frame_ticks * tick_time)
+            steps = int(accumulator / tick_time)
+            accumulator -= steps * tick_time
+            
+        for i in xrange(steps):
+            step()
+            if state.game_over:
+                if match is not None:
+                    match.finish()
+                    connection.close()
+                area.game_over(options.scores, mode)
+        profiler.mark("collapse")
+        
+        if options.no_render:
+            pass
+        elif not paused:
+            screen.blit(background,(0,0))
+            area.update(screen, time_passed_secs)
+            profiler.mark("area")
+            if not timeline.busy():
+                block.update(screen)
+            nextblock.update(screen)
+            profiler.mark("block")
+            for text in Texts:
+                text.update(screen)
+            for view in views:
+                view.update(screen)
+            
+            area.update_texts(screen, time_passed_secs)
+            profiler.mark("texts")
+        else:
+            screen.blit(background,(0,0))
+            for text in Texts:
+                text.update(screen)
+            profiler.mark("texts")
+            area.update(screen, time_passed_secs, paused=True)
+            profiler.mark("area")
+        
+        if not options.no_render:
+            profiler.draw(screen)
+            screen.flush()
+        profiler.mark("display")
+            
+        if options.startup_benchmark:
+            startup.append(("first frame", default_timer()))
+            images.stop_prefetch()
+            report_startup(startup)
+            return
+            
+        for event in pygame.event.get():
             if event.type == QUIT:
+                images.stop_prefetch()
                 exit()
-            elif event.type == TIMER:
-                block_speed += 1
-                Leveldata.level = block_speed-74
-        if event.type == KEYDOWN:
-            if event.key == K_p:
-                paused = not paused
-            elif event.key == K_ESCAPE:
-                exit()
+            if event.type == KEYDOWN:
+                if event.key == K_F3:
+                    profiler.toggle_hud()
+                elif event.key == K_F5:
+                    profiler.toggle_capture()
+                elif event.key == K_p:
+                    recorder.log("key", "P")
+                    paused = not paused
+                elif event.key == K_s and paused:
+                    snapshot.save(options.save, state)
+                    print "Game saved to", options.save
+                elif event.key == K_ESCAPE:
+                    images.stop_prefetch()
+                    exit()
+
+                if not paused:
+                    if event.key in key_names:
+                        recorder.log("key", key_names[event.key])
+                        state.press(key_names[event.key])
+                    elif event.key == K_PLUS or event.key == K_MINUS:
+                        images.next_tileset([-1,1][event.key == K_KP_PLUS])
+                        block.update_sprite()
+                        nextblock.update_sprite()
+                        area.change_tileset()
+                        screen.redraw_all()
+                    #else:
+                        #print "Unknown keyboard event key:", event.key
+        
+        profiler.mark("events")
+        profiler.end_frame()
 
-            if not paused:
-                if event.key == K_LCTRL:
-                    block.rotate('LCTRL')
-                elif event.key == K_LSHIFT or event.key == K_UP:
-                    block.rotate('LSHIFT')
-                elif event.key == K_LEFT:
-                    block.move(1)
-                elif event.key == K_RIGHT:
-                    block.move(2)
-                elif event.key == K_PLUS or event.key == K_MINUS:
-                    block_size = images.next_tileset([-1,1][event.key == K_KP_PLUS])
-                    block.update_sprite()
-                    nextblock.update_sprite()
-                    area.update_block_grid()
-                    area.update_pause_image()
-                #else:
-                    #print "Unknown keyboard event key:", event.key
\ No newline at end of file
+if __name__ == "__main__":
+    main()
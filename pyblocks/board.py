@@ -0,0 +1,274 @@
+# The rules of pyblocks without any display code, licensed under GPLv3
+#
+# Nothing in here imports pygame, so a Board can be created and played
+# on a machine without a display, fonts or images.
+
+import copy, random
+from math import floor
+
+EMPTY = 0
+WALL = 100
+colors = 6
+
+collapse_dirs = [(0,1), (-1,1), (1,1), (1,0)]
+
+def collapse_score(count, combo):
+    score = int((300 * (count - 2)) * ((combo+1) ** 2))
+    return int(round(score / 10.0) * 10)
+
+# Every block color in every cell has its own random number, and a board's hash
+# is the xor of the numbers of all its blocks. It's updated as blocks come and
+# go, so equal boards always have equal hashes without ever being scanned.
+zobrist_tables = {}
+
+def zobrist_table(width, height):
+    key = (width, height)
+    if key not in zobrist_tables:
+        rng = random.Random("%dx%d" % key)
+        zobrist_tables[key] = [[[0] + [int(rng.getrandbits(62)) for color in range(colors)] for x in range(width)] for y in range(height)]
+    return zobrist_tables[key]
+
+class Disjoint_set:
+    def __init__(self):
+        self.parent = {}
+        self.rank = {}
+
+    def find(self, item):
+        parent = self.parent
+        if item not in parent:
+            parent[item] = item
+            self.rank[item] = 0
+            return item
+
+        root = item
+        while parent[root] != root:
+            root = parent[root]
+
+        while parent[item] != root:
+            parent[item], item = root, parent[item]
+
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+        return a
+
+# Merges the ((x, y), dir, count) runs that share blocks into (cells, runs) groups.
+# Every run is walked once and joined with the run that already claimed each of its cells.
+def group_runs(runs):
+    groups = Disjoint_set()
+    owner = {}
+
+    for index, ((x, y), dir, count) in enumerate(runs):
+        groups.find(index)
+        for i in range(count):
+            cell = (x + i*dir[0], y + i*dir[1])
+            if cell in owner:
+                groups.union(index, owner[cell])
+            else:
+                owner[cell] = index
+
+    grouped = {}
+    order = []
+    for index, run in enumerate(runs):
+        root = groups.find(index)
+        if root not in grouped:
+            grouped[root] = ([], [])
+            order.append(root)
+        grouped[root][1].append(run)
+
+    for cell, index in sorted(owner.items(), key=lambda item: (item[0][1], item[0][0])):
+        grouped[groups.find(index)][0].append(cell)
+
+    return [grouped[root] for root in order]
+
+class Cascade_step:
+    def __init__(self, combo):
+        self.combo = combo
+        self.scores = []
+        self.removed = []
+        self.moves = []
+
+class Board:
+    def __init__(self, width=6, height=18):
+        self.x_edge, self.y_edge = width, height
+
+        self.data = []
+        for i in range(self.y_edge):
+            self.data.append([EMPTY]*self.x_edge)
+        self.data.append([WALL]*self.x_edge)
+
+        self.changed_cells = set()
+        self.collapse_groups = []
+        self.combo = 0
+
+        self.zobrist = zobrist_table(width, height)
+        self.hash = 0
+
+    def copy(self):
+        clone = copy.copy(self)
+        clone.data = [row[:] for row in self.data]
+        clone.changed_cells = set(self.changed_cells)
+        clone.collapse_groups = list(self.collapse_groups)
+        return clone
+
+    def compute_hash(self):
+        value = 0
+        for y, row in enumerate(self.data[:-1]):
+            for x, color in enumerate(row):
+                value ^= self.zobrist[y][x][color]
+        return value
+
+    def get_color(self, x, y):
+        if 0 <= x < self.x_edge and 0 <= y <= self.y_edge:
+            return self.data[y][x]
+        return None
+
+    def get_bottom(self, x):
+        for pos, row in enumerate(self.data):
+            if row[x] != EMPTY:
+                return pos
+
+    def add_block(self, x, y, color):
+        row = self.data[y]
+        cell = self.zobrist[y][x]
+        self.hash ^= cell[row[x]] ^ cell[color]
+        row[x] = color
+        self.changed_cells.add((x, y))
+
+    def makes_run(self, x, y, color):
+        # Whether color at (x, y) would line up with three or more of its own kind.
+        for dx, dy in collapse_dirs:
+            count = 1
+            for sign in [-1, 1]:
+                step = 1
+                while self.get_color(x + sign*step*dx, y + sign*step*dy) == color:
+                    count += 1
+                    step += 1
+            if count >= 3:
+                return True
+        return False
+
+    def remove_block(self, x, y):
+        if self.data[y][x] not in [EMPTY, WALL]:
+            self.hash ^= self.zobrist[y][x][self.data[y][x]]
+            self.data[y][x] = EMPTY
+
+    def add_piece(self, x, y, piece_colors):
+        # Places the colors top down starting from row y and returns the ((x, y), color)
+        # cells, or None when the piece would stick out of the top of the board.
+        if y < 0:
+            return None
+
+        cells = []
+        for i, color in enumerate(piece_colors):
+            self.add_block(x, y+i, color)
+            cells.append(((x, y+i), color))
+        return cells
+
+    def push_rows(self, count):
+        # Lifts every block count rows and leaves empty rows at the bottom for the
+        # caller to fill. Returns False without changing anything when blocks would
+        # be pushed out of the top of the board.
+        for row in self.data[:count]:
+            for color in row:
+                if color != EMPTY:
+                    return False
+
+        self.data[:self.y_edge] = self.data[count:self.y_edge] + [[EMPTY]*self.x_edge for i in range(count)]
+        self.changed_cells = set([(x, y - count) for (x, y) in self.changed_cells if y >= count])
+        self.hash = self.compute_hash()
+        return True
+
+    def check_collapse(self):
+        # A new run can only pass through a cell that has changed since the last check,
+        # so only the lines through those cells are examined instead of the whole board.
+        found = set()
+
+        for (x, y) in self.changed_cells:
+            target = self.data[y][x]
+            if target in [EMPTY, WALL]:
+                continue
+
+            for dir_index, (dx, dy) in enumerate(collapse_dirs):
+                start_x, start_y = x, y
+                while self.get_color(start_x-dx, start_y-dy) == target:
+                    start_x -= dx
+                    start_y -= dy
+
+                count = 1
+                while self.get_color(start_x+count*dx, start_y+count*dy) == target:
+                    count += 1
+
+                if count >= 3:
+                    found.add((start_y, start_x, dir_index, count))
+
+        self.changed_cells = set()
+
+        runs = [((x, y), collapse_dirs[dir_index], count) for (y, x, dir_index, count) in sorted(found)]
+        self.collapse_groups.extend(group_runs(runs))
+
+        return bool(self.collapse_groups)
+
+    def compact_columns(self, columns):
+        # Gravity in one pass per column: walk up and move every block down to the lowest
+        # free row. columns maps x to the (bottom, top) rows of the holes in that column.
+        # Nothing below the bottom hole can move, and an empty cell above the top hole is
+        # the air above the stack, so only the part in between and the blocks resting
+        # on it are visited. Returns the ((x, y), (x, to_y), color) moves.
+        moves = []
+        for x in sorted(columns):
+            bottom, top = columns[x]
+            to_y = bottom
+            for y in range(bottom, -1, -1):
+                color = self.data[y][x]
+                if color == EMPTY:
+                    if y < top:
+                        break
+                    continue
+                if y != to_y:
+                    self.remove_block(x, y)
+                    self.add_block(x, to_y, color)
+                    moves.append(((x, y), (x, to_y), color))
+                to_y -= 1
+
+        return moves
+
+    def do_collapse(self):
+        step = Cascade_step(self.combo)
+        columns = {}
+
+        # Every group is scored once by its number of distinct blocks, so crosses and
+        # long runs count in full. The text floats up from the middle of the longest run.
+        for cells, runs in self.collapse_groups:
+            (x,y), dir, count = max(runs, key=lambda run: run[2])
+            center = floor(count/2.0)
+            center_x, center_y = x + center*dir[0], y + center*dir[1]
+            step.scores.append((collapse_score(len(cells), self.combo), (center_x, center_y)))
+
+            for (x, y) in cells:
+                step.removed.append(((x, y), self.data[y][x]))
+                self.remove_block(x, y)
+                bottom, top = columns.get(x, (y, y))
+                columns[x] = (max(bottom, y), min(top, y))
+
+        self.collapse_groups = []
+        self.combo += 1
+
+        step.moves = self.compact_columns(columns)
+        return step
+
+    def resolve_cascade(self):
+        self.combo = 0
+        steps = []
+        while self.check_collapse():
+            steps.append(self.do_collapse())
+        return steps
@@ -0,0 +1,147 @@
+# Screen wrappers for drawing pyblocks, licensed under GPLv3
+#
+# Both classes are handed to the update methods in place of the display surface.
+# Screen draws straight onto the display and pushes all of it on flush().
+# Dirty_screen only records what was drawn, and on flush() redraws and pushes
+# the rectangles whose contents differ from the previous frame.
+
+import pygame
+from itertools import islice
+from collections import Counter
+
+class Screen:
+    def __init__(self, surface):
+        self.surface = surface
+
+    def get_size(self):
+        return self.surface.get_size()
+
+    def blit(self, image, dest, area=None):
+        return self.surface.blit(image, dest, area)
+
+    def blits(self, blits, count):
+        # Draws the first count (image, position) pairs of blits, in one call where
+        # pygame has it.
+        if hasattr(self.surface, 'blits'):
+            self.surface.blits(islice(blits, count), False)
+        else:
+            blit = self.surface.blit
+            for image, dest in islice(blits, count):
+                blit(image, dest)
+
+    def mark_dirty(self, rect):
+        pass
+
+    def redraw_all(self):
+        pass
+
+    def flush(self):
+        pygame.display.update()
+
+class Dirty_screen(Screen):
+    def __init__(self, surface):
+        Screen.__init__(self, surface)
+        self.entries = []
+        self.last_entries = []
+        self.marked = []
+        # The rectangles around the batches of this frame and the last one. Those
+        # of older frames are spare and used again.
+        self.batch_rects = []
+        self.last_batch_rects = []
+        self.spare_rects = []
+        self.full_redraw = True
+
+    def blit(self, image, dest, area=None):
+        if area is None:
+            size = image.get_size()
+        else:
+            size = pygame.Rect(area).size
+        rect = pygame.Rect((int(dest[0]), int(dest[1])), size)
+        self.entries.append((image, rect, area))
+        return rect
+
+    def blits(self, blits, count):
+        # A batch is a lot of small images that move every frame. It's kept as one
+        # entry without an image, with the pairs and their count in place of the
+        # area, and the whole rectangle around it is redrawn instead of comparing
+        # them one by one. The pairs are only read again in flush(), so they must
+        # stay as they are until then. Positions that are rects are used as they
+        # are, so a batch of them allocates nothing per image.
+        if not count:
+            return
+        if self.spare_rects:
+            rect = self.spare_rects.pop()
+        else:
+            rect = pygame.Rect(0, 0, 0, 0)
+        first = True
+        for image, dest in islice(blits, count):
+            if not isinstance(dest, pygame.Rect):
+                dest = pygame.Rect(dest[0], dest[1], image.get_width(), image.get_height())
+            if first:
+                rect.x, rect.y, rect.w, rect.h = dest.x, dest.y, dest.w, dest.h
+                first = False
+            else:
+                rect.union_ip(dest)
+        self.batch_rects.append(rect)
+        self.entries.append((None, rect, (blits, count)))
+        self.marked.append(rect)
+
+    def mark_dirty(self, rect):
+        # For images that were drawn into without being replaced.
+        self.marked.append(pygame.Rect(rect))
+
+    def redraw_all(self):
+        self.full_redraw = True
+
+    def find_dirty_rects(self):
+        screen_rect = self.surface.get_rect()
+        if self.full_redraw:
+            return [screen_rect]
+
+        # An image counts as unchanged when the same surface lands on the same spot.
+        # They are counted, since a cached text can be drawn twice at one spot and
+        # only one of them go away.
+        old = Counter((id(image), tuple(rect)) for image, rect, area in self.last_entries)
+        new = Counter((id(image), tuple(rect)) for image, rect, area in self.entries)
+
+        rects = self.marked[:]
+        rects.extend(pygame.Rect(rect) for image, rect in (old - new) + (new - old))
+
+        merged = []
+        for rect in rects:
+            rect = rect.clip(screen_rect)
+            if not rect.width or not rect.height:
+                continue
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+
+        return merged
+
+    def flush(self):
+        rects = self.find_dirty_rects()
+
+        for dirty in rects:
+            self.surface.set_clip(dirty)
+            for image, rect, area in self.entries:
+                if not rect.colliderect(dirty):
+                    continue
+                if image is None:
+                    Screen.blits(self, *area)
+                else:
+                    self.surface.blit(image, rect, area)
+        self.surface.set_clip(None)
+
+        if rects:
+            pygame.display.update(rects)
+
+        self.last_entries = self.entries
+        self.entries = []
+        self.marked = []
+        spare = self.last_batch_rects
+        self.spare_rects.extend(spare)
+        del spare[:]
+        self.last_batch_rects, self.batch_rects = self.batch_rects, spare
+        self.full_redraw = False
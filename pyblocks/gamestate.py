@@ -0,0 +1,213 @@
+# A complete game of pyblocks that can be stepped without pygame, licensed under GPLv3
+#
+# Positions are measured in board cells. Speeds are given in pixels per second
+# on the classic 32 pixel tiles, the same numbers blocks.py has always used.
+
+import random
+from math import floor
+from board import Board, EMPTY, colors
+
+cell_size = 32.
+base_speed = 75.
+speedup_bonus = 250.
+
+# The game always advances in steps of tick_time, however fast the frames are drawn,
+# and the blocks speed up every ramp_ticks steps, five seconds of play.
+tick_rate = 40
+tick_time = 1. / tick_rate
+ramp_ticks = 5 * tick_rate
+
+classic_size = (6, 18)
+min_size = (3, 6)
+max_size = (64, 256)
+
+def parse_size(text):
+    # Turns "WIDTHxHEIGHT" into a (width, height) tuple within min_size and max_size.
+    try:
+        width, height = [int(number) for number in text.lower().split('x')]
+    except ValueError:
+        raise ValueError("Board size must look like 6x18, not %r" % text)
+    if not (min_size[0] <= width <= max_size[0] and min_size[1] <= height <= max_size[1]):
+        raise ValueError("Board size must be between %dx%d and %dx%d" % (min_size + max_size))
+    return width, height
+
+class Piece:
+    def __init__(self, piece_colors, x, y, speed):
+        self.colors = piece_colors
+        self.x = x
+        self.y = float(y)
+        self.target = self.y
+        self.speed = speed
+        self.speedup = False
+        self.terminate = False
+
+    def rotate(self, dir):
+        if dir > 0:
+            self.colors.append(self.colors.pop(0))
+        else:
+            self.colors.insert(0, self.colors.pop())
+
+    def update(self, time):
+        if self.speed > 0:
+            dest_dist = abs(self.target - self.y)
+            travel_dist = min(dest_dist, time * (self.speed + self.speedup * speedup_bonus) / cell_size)
+
+            if travel_dist * cell_size < 0.5:
+                self.y = self.target
+                self.speed = 0
+                self.terminate = True
+            else:
+                self.y += travel_dist
+
+        self.speedup = False
+
+class Landing:
+    def __init__(self, cells, steps):
+        self.cells = cells
+        self.steps = steps
+        self.score = 0
+        for step in steps:
+            for score, center in step.scores:
+                self.score += score
+
+        # Every combo after the first collapse sends a row of garbage to the other
+        # player. garbage holds the rows this landing was pushed up by.
+        self.attack = max(0, len(steps) - 1)
+        self.garbage = []
+
+class GameState:
+    def __init__(self, seed=None, width=6, height=18, speed=base_speed, ramp_ticks=ramp_ticks):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.board = Board(width, height)
+        self.spawn_x = (width - 1) // 2
+
+        self.score = 0
+        self.landings = 0
+        self.speed = speed
+        self.level = int(self.speed - base_speed + 1)
+        self.game_over = False
+        self.ticks = 0
+        self.ramp_ticks = ramp_ticks
+        self.garbage = 0
+
+        self.piece = self.new_piece(1)
+        self.next_piece = self.new_piece(1)
+
+    def new_piece(self, y):
+        piece_colors = [self.random.randint(1, colors) for i in range(3)]
+        piece = Piece(piece_colors, self.spawn_x, y, self.speed)
+        self.retarget(piece)
+        return piece
+
+    def retarget(self, piece):
+        piece.target = float(self.board.get_bottom(piece.x) - 3)
+
+    def move(self, dir):
+        piece = self.piece
+        if piece.terminate or self.game_over:
+            return
+
+        x = piece.x + dir
+        if 0 <= x < self.board.x_edge and self.board.get_color(x, int(floor(piece.y)) + 3) == EMPTY:
+            piece.x = x
+            self.retarget(piece)
+
+    def rotate(self, dir):
+        self.piece.rotate(dir)
+
+    def press(self, key):
+        # The keyboard controls by name, shared by the main loop and the replays.
+        if key == 'LCTRL':
+            self.rotate(-1)
+        elif key == 'LSHIFT' or key == 'UP':
+            self.rotate(1)
+        elif key == 'LEFT':
+            self.move(-1)
+        elif key == 'RIGHT':
+            self.move(1)
+        elif key == 'DOWN':
+            self.accelerate()
+
+    def accelerate(self):
+        self.piece.speedup = True
+
+    def increase_speed(self):
+        self.speed += 1
+        self.level = int(self.speed - base_speed + 1)
+
+    def add_garbage(self, rows):
+        # The rows are pushed under the board at the next landing, while no piece is falling.
+        self.garbage += rows
+
+    def push_garbage(self):
+        # Fills the new bottom rows with colors that don't line up with their
+        # neighbours, so the garbage itself never collapses. Returns the rows, or
+        # None when the board overflowed.
+        board = self.board
+        count = min(self.garbage, board.y_edge)
+        self.garbage = 0
+        if not board.push_rows(count):
+            return None
+
+        rows = []
+        for y in range(board.y_edge - 1, board.y_edge - 1 - count, -1):
+            row = []
+            for x in range(board.x_edge):
+                palette = [color for color in range(1, colors+1) if not board.makes_run(x, y, color)]
+                color = self.random.choice(palette or range(1, colors+1))
+                board.add_block(x, y, color)
+                row.append(color)
+            rows.append(row)
+        return rows
+
+    def tick(self):
+        # Counts one fixed step of play time, collapses being shown included. Pieces
+        # are moved by update(), which the main loop skips while collapses are shown.
+        self.ticks += 1
+        if self.ramp_ticks and self.ticks % self.ramp_ticks == 0:
+            self.increase_speed()
+
+    def land(self):
+        piece = self.piece
+        cells = self.board.add_piece(piece.x, int(piece.target), piece.colors)
+        if cells is None:
+            self.game_over = True
+            return Landing([], [])
+
+        landing = Landing(cells, self.board.resolve_cascade())
+        self.score += landing.score
+        self.landings += 1
+
+        if self.garbage:
+            landing.garbage = self.push_garbage()
+            if landing.garbage is None:
+                landing.garbage = []
+                self.game_over = True
+                return landing
+
+        self.piece = self.next_piece
+        self.piece.y = -1.
+        self.retarget(self.piece)
+        self.next_piece = self.new_piece(1)
+
+        if self.board.data[2][self.spawn_x] != EMPTY:
+            self.game_over = True
+
+        return landing
+
+    def update(self, time):
+        # Lands the piece that touched down on the previous update, then lets the
+        # current one fall. Returns the Landing, or None when nothing landed.
+        landing = None
+        if self.game_over:
+            return landing
+
+        if self.piece.terminate:
+            landing = self.land()
+            if self.game_over:
+                return landing
+
+        self.piece.update(time)
+        return landing
+
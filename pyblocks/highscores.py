@@ -0,0 +1,345 @@
+# High scores of pyblocks kept on disk, licensed under GPLv3
+#
+# Usage: python highscores.py [options]
+# Every finished game is appended to a log as a fixed size record with a CRC,
+# so a write that a crash cut short is noticed and dropped the next time the log
+# is opened. The best scores of every mode, tileset and day are kept in small
+# heaps, which go to an index file next to the log every now and then, written
+# as records of the log behind a table of their keys. Opening the list reads
+# that table and only the records logged after the index, however long the log
+# has grown. The heap of a key is read from the index when it's first needed,
+# and the best scores of any mix of modes, tilesets and days are found among
+# the heaps alone.
+#
+# Records are written in batches. The log is synced to the disk after every
+# batch, the index is written to a new file that replaces the old one only once
+# it's complete.
+
+import os, time, struct, binascii, heapq, random
+from timeit import default_timer
+from optparse import OptionParser
+
+# CRC of the rest, score, landings, time, seed, board width and height, mode and tileset.
+record = struct.Struct("<IiIdqHH16s20s")
+# Records in the log when the index was written, the list size, the number of
+# keys and the CRC of the table of keys.
+index_head = struct.Struct("<IHII")
+# Mode, tileset, day, and where the heap of that key starts in the index and how
+# many records it has.
+index_key = struct.Struct("<16s20s10sII")
+index_header = "pyblocks scores 1"
+default_file = "pyblocks.scores"
+read_records = 4096
+
+def pack_record(score, landings, when, seed, width, height, mode, tileset):
+    body = record.pack(0, score, landings, when, seed, width, height, mode, tileset)[4:]
+    return struct.pack("<I", binascii.crc32(body) & 0xffffffff) + body
+
+def unpack_record(data, offset=0):
+    # Returns the key and the heap entry of a record, or None when it's damaged.
+    fields = record.unpack_from(data, offset)
+    if binascii.crc32(buffer(data, offset + 4, record.size - 4)) & 0xffffffff != fields[0]:
+        return None
+    score, landings, when, seed, width, height, mode, tileset = fields[1:]
+    return (mode.rstrip('\0'), tileset.rstrip('\0'), day(when)), (score, -when, landings, seed, width, height)
+
+# Time zones move the day by whole quarters of an hour, so every quarter only
+# needs to be turned into a date once.
+days = {}
+
+def day(when):
+    quarter = int(when // 900)
+    try:
+        return days[quarter]
+    except KeyError:
+        days[quarter] = result = time.strftime("%Y-%m-%d", time.localtime(quarter * 900))
+        return result
+
+class Score:
+    def __init__(self, score, when, landings, seed, width, height, mode, tileset):
+        self.score = score
+        self.when = when
+        self.landings = landings
+        self.seed = seed
+        self.width, self.height = width, height
+        self.mode = mode
+        self.tileset = tileset
+
+    def __str__(self):
+        return "%8d  %s  %-10s %-14s %dx%d, %d landings" % (self.score, time.strftime("%Y-%m-%d %H:%M", time.localtime(self.when)),
+                                                          self.mode, self.tileset, self.width, self.height, self.landings)
+
+class Score_list:
+    def __init__(self, filename=default_file, size=10, batch_size=1000, index_interval=100000):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self.size = size
+        self.batch_size = batch_size
+        self.index_interval = index_interval
+        self.pending = []
+        self.damaged = 0
+        self.index = None
+
+        self.load_index()
+        self.replay()
+        self.log = open(filename, 'ab')
+
+    def load_index(self):
+        # Only the table of keys is read here. The heap of a key is read when it's
+        # first needed, so a game over only reads the heaps of its own mode and
+        # tileset. An index that can't be read, or was made for another list size,
+        # is rebuilt from the log.
+        self.heaps = {}
+        self.unread = {}
+        self.records = self.indexed = 0
+        try:
+            f = open(self.index_filename, 'rb')
+        except IOError:
+            return
+        try:
+            if f.readline().strip() != index_header:
+                raise ValueError
+            records, size, count, crc = index_head.unpack(f.read(index_head.size))
+            table = f.read(count * index_key.size)
+            if size != self.size or len(table) != count * index_key.size or binascii.crc32(table) & 0xffffffff != crc:
+                raise ValueError
+        except (EnvironmentError, ValueError, struct.error):
+            f.close()
+            return
+
+        start = f.tell()
+        for offset in xrange(0, len(table), index_key.size):
+            mode, tileset, key_day, first, length = index_key.unpack_from(table, offset)
+            self.unread[(mode.rstrip('\0'), tileset.rstrip('\0'), key_day)] = (start + first * record.size, length)
+        self.records = self.indexed = records
+        self.index = f
+
+    def close_index(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def heap(self, key):
+        heap = self.heaps.get(key)
+        if heap is None:
+            heap = self.heaps[key] = []
+            if key in self.unread:
+                # A damaged record of the index is skipped like one of the log. The
+                # log still has it, deleting the index brings it back.
+                offset, length = self.unread.pop(key)
+                self.index.seek(offset)
+                data = self.index.read(length * record.size)
+                for offset in xrange(0, len(data) // record.size * record.size, record.size):
+                    unpacked = unpack_record(data, offset)
+                    if unpacked is None or unpacked[0] != key:
+                        self.damaged += 1
+                    else:
+                        heap.append(unpacked[1])
+                heapq.heapify(heap)
+        return heap
+
+    def replay(self):
+        # Adds the records the index doesn't cover yet. A record that was only
+        # partly written when the game stopped is cut off the end of the log.
+        try:
+            length = os.path.getsize(self.filename)
+        except OSError:
+            length = 0
+        if length < self.records * record.size:
+            # The log was replaced behind the index's back.
+            self.close_index()
+            self.heaps = {}
+            self.unread = {}
+            self.records = self.indexed = 0
+
+        f = open(self.filename, 'ab+')
+        try:
+            f.seek(self.records * record.size)
+            while True:
+                data = f.read(read_records * record.size)
+                count = len(data) // record.size
+                for offset in xrange(0, count * record.size, record.size):
+                    unpacked = unpack_record(data, offset)
+                    if unpacked is None:
+                        self.damaged += 1
+                    else:
+                        self.insert(*unpacked)
+                self.records += count
+                if len(data) < read_records * record.size:
+                    break
+            if length > self.records * record.size:
+                f.truncate(self.records * record.size)
+        finally:
+            f.close()
+
+    def insert(self, key, entry):
+        # Every heap keeps its best size entries with the worst of them on top,
+        # so most scores are turned down after a single comparison.
+        heap = self.heap(key)
+        if len(heap) < self.size:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def add(self, score, landings, seed=None, size=(6, 18), mode="single", tileset="-", when=None):
+        if when is None:
+            when = time.time()
+        if seed is None:
+            seed = -1
+        mode, tileset = mode[:16], tileset[:20]
+        self.pending.append(pack_record(score, landings, when, seed, size[0], size[1], mode, tileset))
+        self.insert((mode, tileset, day(when)), (score, -when, landings, seed, size[0], size[1]))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.log.write("".join(self.pending))
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.records += len(self.pending)
+        self.pending = []
+        if self.records - self.indexed >= self.index_interval:
+            self.write_index()
+
+    def write_index(self):
+        # The heaps go in as records of the log, one key after the other, behind a
+        # table of the keys.
+        for key in self.unread.keys():
+            self.heap(key)
+        self.close_index()
+
+        table = []
+        records = []
+        for (mode, tileset, key_day), heap in self.heaps.iteritems():
+            if heap:
+                table.append(index_key.pack(mode, tileset, key_day, len(records), len(heap)))
+                records.extend([pack_record(score, landings, -when, seed, width, height, mode, tileset)
+                                for score, when, landings, seed, width, height in heap])
+        table = "".join(table)
+
+        f = open(self.index_filename + '.tmp', 'wb')
+        try:
+            f.write(index_header + "\n")
+            f.write(index_head.pack(self.records, self.size, len(table) // index_key.size, binascii.crc32(table) & 0xffffffff))
+            f.write(table)
+            f.write("".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+        os.rename(self.index_filename + '.tmp', self.index_filename)
+        self.indexed = self.records
+
+    def close(self):
+        # More than a batch of records behind and the index is brought up to date,
+        # so the next open never has much of the log to read.
+        self.flush()
+        if self.records - self.indexed >= self.batch_size:
+            self.write_index()
+        self.close_index()
+        self.log.close()
+
+    def best(self, count=None, mode=None, tileset=None, since=None, until=None):
+        # The best scores, best first. since and until are days as YYYY-MM-DD and
+        # both count, the rest are exact names. No more than the list size are kept
+        # for any mode, tileset and day, so no more than that can be asked for.
+        count = min(count or self.size, self.size)
+        chosen = []
+        for key in self.heaps.keys() + self.unread.keys():
+            heap_mode, heap_tileset, heap_day = key
+            if mode is not None and heap_mode != mode:
+                continue
+            if tileset is not None and heap_tileset != tileset:
+                continue
+            if since is not None and heap_day < since:
+                continue
+            if until is not None and heap_day > until:
+                continue
+            chosen.extend([(entry, heap_mode, heap_tileset) for entry in self.heap(key)])
+
+        best = []
+        for (score, when, landings, seed, width, height), heap_mode, heap_tileset in heapq.nlargest(count, chosen):
+            if seed == -1:
+                seed = None
+            best.append(Score(score, -when, landings, seed, width, height, heap_mode, heap_tileset))
+        return best
+
+def print_scores(scores):
+    if not scores:
+        print "No scores yet."
+    for place, score in enumerate(scores):
+        print "%3d. %s" % (place + 1, score)
+
+def benchmark(count):
+    # Fills a new list in a temporary directory with made up games.
+    import tempfile, shutil
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "benchmark.scores")
+        rng = random.Random(0)
+        modes = ["single", "ai", "versus", "sim-random", "sim-lookahead"]
+        tilesets = ["Default", "Shiny", "Animals", "Doom"]
+        now = time.time()
+
+        start = default_timer()
+        scores = Score_list(filename)
+        for i in xrange(count):
+            scores.add(int(rng.expovariate(1 / 5000.)), rng.randrange(500), i, (6, 18), rng.choice(modes), rng.choice(tilesets), now - rng.uniform(0, 365 * 86400))
+        scores.close()
+        elapsed = default_timer() - start
+        print "Added %d scores in %.2f seconds, %.0f scores/sec, %d bytes of log" % (count, elapsed, count / elapsed, os.path.getsize(filename))
+
+        start = default_timer()
+        scores = Score_list(filename)
+        print "Opened with the index in %.2f ms" % ((default_timer() - start) * 1000)
+        start = default_timer()
+        scores.best(mode="single", tileset="Shiny", since=day(now - 30 * 86400))
+        scores.best()
+        print "Two queries in %.2f ms" % ((default_timer() - start) * 1000)
+        scores.close()
+
+        # What a game over does: one more score and the best of its mode and tileset.
+        start = default_timer()
+        scores = Score_list(filename)
+        scores.add(1000, 50, None, (6, 18), "single", "Shiny")
+        scores.best(mode="single", tileset="Shiny")
+        scores.close()
+        print "A game over in %.2f ms" % ((default_timer() - start) * 1000)
+
+        os.remove(filename + '.idx')
+        start = default_timer()
+        scores = Score_list(filename)
+        print "Opened without the index in %.2f seconds" % (default_timer() - start)
+        scores.close()
+    finally:
+        shutil.rmtree(directory)
+
+def main(argv=None):
+    parser = OptionParser(usage="python highscores.py [options]")
+    parser.add_option("--file", default=default_file, help="the high score log, %default by default")
+    parser.add_option("-n", "--count", type="int", default=10, help="how many scores to show, up to 10")
+    parser.add_option("--mode", help="only games of this mode: single, ai, versus or sim-POLICY")
+    parser.add_option("--tileset", help="only games played with this tileset")
+    parser.add_option("--since", metavar="YYYY-MM-DD", help="only games from this day on")
+    parser.add_option("--until", metavar="YYYY-MM-DD", help="only games up to this day")
+    parser.add_option("--benchmark", type="int", metavar="COUNT", help="time adding COUNT made up scores to a new list")
+    options, args = parser.parse_args(argv)
+
+    if options.benchmark:
+        benchmark(options.benchmark)
+        return
+
+    scores = Score_list(options.file)
+    try:
+        print_scores(scores.best(options.count, options.mode, options.tileset, options.since, options.until))
+        if scores.damaged:
+            print "%d damaged records were skipped." % scores.damaged
+    finally:
+        scores.close()
+
+if __name__ == "__main__":
+    main()
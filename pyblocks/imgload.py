@@ -1,17 +1,138 @@
-import os
+import os, mmap
 import pygame
 from pygame.locals import *
 
 #From chimp line by line tutorial
 #http://www.pygame.org/docs/tut/chimp/ChimpLineByLine.html
 
-def load_image(name, colorkey=None): 
-    fullname = os.path.join('images', name)
+image_dir = 'images'
+
+#Converted images are kept in cache_dir as raw pixels in the display format, so the
+#next start can copy them straight into surfaces instead of decoding the files again.
+#Set cache_dir to None to turn the cache off.
+cache_dir = 'cache'
+cache_header = "pyblocks surface 1"
+
+def load_image(name, colorkey=None):
+    image = load_cached(name)
+    if image is None:
+        image, rect = prepare_image(decode_image(name), name=name)
+    return set_colorkey(image, colorkey)
+
+#Decoding doesn't need the display, so it can be done ahead of time in another thread.
+def decode_image(name):
+    fullname = os.path.join(image_dir, name)
     #fullname = os.path.join(name)
-    image = pygame.image.load(fullname)
+    return pygame.image.load(fullname)
+
+def prepare_image(image, colorkey=None, name=None):
     image = image.convert()
+    if name is not None:
+        store_cached(name, image)
+    return set_colorkey(image, colorkey)
+
+def set_colorkey(image, colorkey=None):
     if colorkey is not None:
         if colorkey is -1:
             colorkey = image.get_at((0,0))
         image.set_colorkey(colorkey, RLEACCEL)
     return image, image.get_rect()
+
+#One directory listing instead of a file system probe for every name that might exist.
+listing = None
+
+def list_images():
+    global listing
+    if listing is None:
+        try:
+            listing = set(os.listdir(image_dir))
+        except OSError:
+            listing = set()
+    return listing
+
+def cache_path(name):
+    return os.path.join(cache_dir, name.replace(os.sep, '_') + '.surface')
+
+def cache_key(name, size, pitch):
+    # A cached image is only used for the same version of the source file and
+    # the same pixel format the display has now.
+    display = pygame.display.get_surface()
+    if display is None:
+        return None
+    stat = os.stat(os.path.join(image_dir, name))
+    return "%s %s %r %d %dx%d %d %d %s" % (cache_header, name, stat.st_mtime, stat.st_size, size[0], size[1], pitch,
+                                          display.get_bitsize(), ",".join([str(mask) for mask in display.get_masks()]))
+
+def is_cached(name):
+    # Only reads the header, so it's cheap enough to call from the prefetch thread.
+    if cache_dir is None:
+        return False
+    try:
+        f = open(cache_path(name), 'rb')
+        try:
+            words = f.readline().split()
+        finally:
+            f.close()
+        size = [int(number) for number in words[6].split('x')]
+        return " ".join(words) == cache_key(name, size, int(words[7]))
+    except (EnvironmentError, IndexError, ValueError):
+        return False
+
+def load_cached(name):
+    # Returns the converted image, or None when it's not cached or the entry is stale.
+    if cache_dir is None:
+        return None
+    try:
+        f = open(cache_path(name), 'rb')
+    except IOError:
+        return None
+
+    try:
+        try:
+            header = f.readline()
+            words = header.split()
+            size = [int(number) for number in words[6].split('x')]
+            pitch = int(words[7])
+            if " ".join(words) != cache_key(name, size, pitch):
+                return None
+
+            image = pygame.Surface(size, 0, pygame.display.get_surface())
+            if image.get_pitch() != pitch:
+                return None
+
+            pixels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if len(pixels) != len(header) + pitch * size[1]:
+                    return None
+                image.get_buffer().write(pixels[len(header):], 0)
+            finally:
+                pixels.close()
+            return image
+        except (EnvironmentError, IndexError, ValueError, pygame.error):
+            return None
+    finally:
+        f.close()
+
+def store_cached(name, image):
+    # Failing to write the cache only means the image is decoded again next time.
+    if cache_dir is None or image.get_bitsize() <= 8:
+        return
+    try:
+        key = cache_key(name, image.get_size(), image.get_pitch())
+        if key is None:
+            return
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        filename = cache_path(name)
+        f = open(filename + '.tmp', 'wb')
+        try:
+            f.write(key + "\n")
+            f.write(image.get_buffer().raw)
+        finally:
+            f.close()
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+    except (EnvironmentError, pygame.error):
+        pass
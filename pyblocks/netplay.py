@@ -0,0 +1,332 @@
+# Two player games of pyblocks over a network, licensed under GPLv3
+#
+# Usage: python netplay.py [options]
+# Both players play their own game on their own machine. After every landing a
+# single line of text goes to the other side with the piece, the garbage rows
+# the board was pushed up by and the rows of garbage sent back. The other side
+# replays it on a copy of the board, so full boards are never sent. Sockets are
+# polled without blocking once per frame, next to the drawing.
+#
+# Run on its own, this module plays two computer players against each other
+# without a display, one of them in a second process, and reports the round trip
+# times. Start it twice with --host and --connect to play over a real network.
+
+import sys, time, socket, select, errno, random
+from timeit import default_timer
+from optparse import OptionParser
+from board import Board
+from gamestate import GameState, Landing, base_speed, parse_size, classic_size, tick_time
+
+protocol = 1
+default_port = 7613
+ping_interval = 1.
+rtt_history = 200
+
+class Connection:
+    def __init__(self, sock):
+        sock.setblocking(0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.incoming = ""
+        self.outgoing = ""
+        self.pending = []
+        self.closed = False
+        self.bytes_sent = 0
+        self.last_ping = 0.
+        self.rtts = []
+        self.rtt_ms = 0
+
+    def send(self, *words):
+        self.outgoing += " ".join([str(word) for word in words]) + "\n"
+        self.flush()
+
+    def flush(self):
+        while self.outgoing and not self.closed:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except socket.error, error:
+                if error.args[0] not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    self.closed = True
+                return
+            self.bytes_sent += sent
+            self.outgoing = self.outgoing[sent:]
+
+    def poll(self, timeout=0):
+        # Returns the messages that arrived completely as lists of words, after
+        # the ones wait_for passed over. Pings are answered here and never returned.
+        messages, self.pending = self.pending, []
+        if self.closed:
+            return messages
+
+        readable, writable, errors = select.select([self.sock], [], [], timeout)
+        if readable:
+            try:
+                data = self.sock.recv(65536)
+                if not data:
+                    self.closed = True
+                self.incoming += data
+            except socket.error, error:
+                if error.args[0] not in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    self.closed = True
+
+        while "\n" in self.incoming:
+            line, self.incoming = self.incoming.split("\n", 1)
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "ping":
+                self.send("pong", words[1])
+            elif words[0] == "pong":
+                self.add_rtt(default_timer() - float(words[1]))
+            else:
+                messages.append(words)
+
+        now = default_timer()
+        if now - self.last_ping >= ping_interval:
+            self.last_ping = now
+            self.send("ping", repr(now))
+        self.flush()
+        return messages
+
+    def add_rtt(self, rtt):
+        self.rtts.append(rtt)
+        if len(self.rtts) > rtt_history:
+            del self.rtts[0]
+        self.rtt_ms = int(round(rtt * 1000))
+
+    def wait_for(self, name, timeout=10.):
+        # Messages that arrive before or along with the one waited for are kept
+        # for the next poll.
+        end = default_timer() + timeout
+        while not self.closed and default_timer() < end:
+            messages = self.poll(0.05)
+            for i, words in enumerate(messages):
+                if words[0] == name:
+                    self.pending = messages[:i] + messages[i+1:] + self.pending
+                    return words[1:]
+            self.pending = messages + self.pending
+        raise IOError("The other player didn't answer")
+
+    def close(self):
+        # Gives the last messages a moment to leave before the socket is closed.
+        end = default_timer() + 1.
+        while self.outgoing and not self.closed and default_timer() < end:
+            select.select([], [self.sock], [], 0.05)
+            self.flush()
+        self.sock.close()
+        self.closed = True
+
+def host(port, seed, (width, height), speed):
+    # Waits for the other player and tells them which game to play.
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("", port))
+    listener.listen(1)
+    print "Waiting for the other player on port", port
+    sock, address = listener.accept()
+    listener.close()
+    print "Playing against", address[0]
+
+    connection = Connection(sock)
+    connection.send("start", protocol, seed, width, height, repr(speed))
+    return connection
+
+def join(address, timeout=10.):
+    # Returns the connection and the seed, board size and speed of the game. The
+    # host may not be listening yet, so refused connections are retried for a while.
+    host, port = parse_address(address)
+    end = default_timer() + timeout
+    while True:
+        try:
+            sock = socket.create_connection((host, port), timeout)
+            break
+        except socket.error, error:
+            if error.args[0] != errno.ECONNREFUSED or default_timer() > end:
+                raise
+            time.sleep(0.1)
+    connection = Connection(sock)
+    version, seed, width, height, speed = connection.wait_for("start")
+    if int(version) != protocol:
+        raise IOError("The other player has a different version of pyblocks")
+    return connection, int(seed), (int(width), int(height)), float(speed)
+
+def parse_address(address):
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return address, default_port
+
+def rows_string(rows):
+    return "/".join(["".join([str(color) for color in row]) for row in rows]) or "-"
+
+def parse_rows(text):
+    if text == "-":
+        return []
+    return [[int(color) for color in row] for row in text.split('/')]
+
+class Opponent:
+    # A copy of the other player's board, kept up to date from their landings.
+    def __init__(self, width, height):
+        self.board = Board(width, height)
+        self.score = 0
+        self.landings = 0
+        self.game_over = False
+        self.in_sync = True
+        self.changed = True
+
+    def land(self, x, y, piece_colors, garbage, score):
+        cells = self.board.add_piece(x, y, piece_colors)
+        if cells is None:
+            self.game_over = True
+            return
+        landing = Landing(cells, self.board.resolve_cascade())
+        self.score += landing.score
+        self.landings += 1
+
+        if garbage:
+            if not self.board.push_rows(len(garbage)):
+                self.game_over = True
+                return
+            for offset, row in enumerate(garbage):
+                for x, color in enumerate(row):
+                    self.board.add_block(x, self.board.y_edge - 1 - offset, color)
+
+        self.in_sync = self.in_sync and self.score == score
+        self.changed = True
+
+class Match:
+    def __init__(self, connection, state):
+        self.connection = connection
+        self.state = state
+        self.opponent = Opponent(state.board.x_edge, state.board.y_edge)
+        self.sent = 0
+        self.received = 0
+        self.finished = False
+
+    def landed(self, landing):
+        state = self.state
+        if state.game_over:
+            self.finish()
+            return
+        (x, y), color = landing.cells[0]
+        colors = "".join([str(color) for cell, color in landing.cells])
+        self.connection.send("land", x, y, colors, rows_string(landing.garbage), state.score, landing.attack)
+        self.sent += landing.attack
+
+    def update(self, timeout=0):
+        # Returns the rows of garbage the other player has sent since the last call.
+        garbage = 0
+        for words in self.connection.poll(timeout):
+            if words[0] == "land":
+                x, y, colors, rows, score, attack = words[1:7]
+                self.opponent.land(int(x), int(y), [int(color) for color in colors], parse_rows(rows), int(score))
+                garbage += int(attack)
+            elif words[0] == "over":
+                self.opponent.game_over = True
+                self.opponent.score = int(words[1])
+                self.opponent.changed = True
+        self.received += garbage
+        return garbage
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.connection.send("over", self.state.score)
+
+def play_headless(connection, seed, size, speed, policy_name, max_time, realtime):
+    # Computer players from simulate.py steer the pieces. When realtime is set the
+    # game runs at the speed it would have on screen instead of as fast as possible.
+    from simulate import policies, steer
+    policy = policies[policy_name]
+    rng = random.Random(seed ^ connection.sock.getsockname()[1])
+    state = GameState(seed, size[0], size[1], speed)
+    match = Match(connection, state)
+
+    start = default_timer()
+    piece = None
+    while state.ticks * tick_time < max_time and not connection.closed:
+        # Waiting for the next step is done on the socket, so a ping that arrives in
+        # the meantime is answered at once instead of a step later.
+        timeout = 0
+        if realtime:
+            timeout = max(0, start + state.ticks * tick_time - default_timer())
+        garbage = match.update(timeout)
+        if garbage:
+            state.add_garbage(garbage)
+        if realtime and default_timer() < start + state.ticks * tick_time:
+            continue
+        if state.game_over:
+            if match.opponent.game_over:
+                break
+            select.select([], [], [], 0.01)
+            continue
+
+        if state.piece is not piece:
+            piece = state.piece
+            column, rotation = policy(state, rng)
+            steer(state, column, rotation)
+        state.accelerate()
+        state.tick()
+        landing = state.update(tick_time)
+        if landing:
+            match.landed(landing)
+
+    match.finish()
+    connection.close()
+    return state, match
+
+def report(name, state, match):
+    connection = match.connection
+    print "%s: score %d, %d landings, garbage sent %d, received %d, %d bytes sent" % (name, state.score, state.landings, match.sent, match.received, connection.bytes_sent)
+    print "  opponent: score %d, %d landings, copy of the board %s" % (match.opponent.score, match.opponent.landings, ["DIFFERS", "matches"][match.opponent.in_sync])
+    rtts = sorted(connection.rtts)
+    if len(rtts) >= 10:
+        print "  round trip ms: p50 %.2f  p90 %.2f  max %.2f  (%d pings)" % (rtts[len(rtts)//2] * 1000, rtts[int(len(rtts)*0.9)] * 1000, rtts[-1] * 1000, len(rtts))
+    elif rtts:
+        print "  round trip ms: %s  (%d pings)" % (" ".join(["%.2f" % (rtt * 1000) for rtt in rtts]), len(rtts))
+
+def run_client(address, policy_name, max_time, realtime):
+    connection, seed, size, speed = join(address)
+    state, match = play_headless(connection, seed, size, speed, policy_name, max_time, realtime)
+    report("client", state, match)
+    if not match.opponent.in_sync:
+        sys.exit(1)
+
+def main(argv=None):
+    parser = OptionParser(usage="python netplay.py [options]")
+    parser.add_option("--host", type="int", metavar="PORT", help="wait for the other player on PORT")
+    parser.add_option("--connect", metavar="HOST[:PORT]", help="join the game hosted at HOST")
+    parser.add_option("--seed", type="int", default=0, help="seed of the game, chosen by the host")
+    parser.add_option("--board-size", default="%dx%d" % classic_size, metavar="WxH", help="board width and height in blocks, chosen by the host")
+    parser.add_option("--speed", type="float", default=base_speed, help="starting block speed, chosen by the host")
+    parser.add_option("--policy", default="random", help="how the computer player steers, see simulate.py")
+    parser.add_option("--max-time", type="float", default=300., help="seconds of play before the game is stopped")
+    parser.add_option("--realtime", action="store_true", default=False, help="play at the speed of the real game")
+    options, args = parser.parse_args(argv)
+    try:
+        size = parse_size(options.board_size)
+    except ValueError, error:
+        parser.error(str(error))
+
+    if options.connect:
+        run_client(options.connect, options.policy, options.max_time, options.realtime)
+        return
+
+    port = options.host or default_port
+    if options.host is None:
+        # Both players on this machine, the second one in its own process.
+        import multiprocessing
+        client = multiprocessing.Process(target=run_client, args=("localhost:%d" % port, options.policy, options.max_time, options.realtime))
+        client.start()
+
+    connection = host(port, options.seed, size, options.speed)
+    state, match = play_headless(connection, options.seed, size, options.speed, options.policy, options.max_time, options.realtime)
+    report("host", state, match)
+
+    if options.host is None:
+        client.join()
+        if not match.opponent.in_sync or client.exitcode:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
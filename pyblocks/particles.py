@@ -0,0 +1,92 @@
+# Particles for the blocks that collapse in pyblocks, licensed under GPLv3
+#
+# Every particle there will ever be is allocated up front. Their positions,
+# speeds and times left live in flat arrays with the live particles at the
+# front, and a particle that runs out is replaced by the last live one, so
+# neither spawning nor updating nor removing them allocates anything. Each slot
+# keeps its own rect and (image, rect) pair, and all the live ones are drawn
+# with a single call to the screen. When the pool is full new particles are
+# left out instead of making room.
+
+import random
+from array import array
+import pygame
+
+gravity = 900.
+
+class Particles:
+    def __init__(self, capacity=1024, per_cell=12, size=4, life=0.7, seed=None):
+        self.capacity = capacity
+        self.per_cell = per_cell
+        self.size = size
+        self.life = life
+        self.random = random.Random(seed)
+        self.count = 0
+
+        self.x = array('d', [0.]) * capacity
+        self.y = array('d', [0.]) * capacity
+        self.vx = array('d', [0.]) * capacity
+        self.vy = array('d', [0.]) * capacity
+        self.left = array('d', [0.]) * capacity
+        self.colors = array('B', [0]) * capacity
+        self.rects = [pygame.Rect(0, 0, size, size) for i in range(capacity)]
+        self.batch = [None] * capacity
+
+        self.tiles = None
+        self.images = None
+
+    def set_tiles(self, tiles):
+        # The particles of a block are little copies of its tile.
+        self.tiles = tiles
+        self.images = [pygame.transform.scale(image, (self.size, self.size)) for image, rect in tiles]
+        for i in range(self.count):
+            self.batch[i] = (self.images[self.colors[i]], self.rects[i])
+
+    def spawn(self, x, y, color):
+        # Bursts per_cell particles out of the block centered on x, y.
+        uniform = self.random.uniform
+        for n in range(self.per_cell):
+            i = self.count
+            if i == self.capacity:
+                return
+            self.count += 1
+            self.x[i] = x + uniform(-8, 8)
+            self.y[i] = y + uniform(-8, 8)
+            self.vx[i] = uniform(-160, 160)
+            self.vy[i] = uniform(-320, -60)
+            self.left[i] = self.life * uniform(0.5, 1.)
+            self.colors[i] = color
+            if self.images is not None:
+                self.batch[i] = (self.images[color], self.rects[i])
+
+    def update(self, time):
+        x, y, vx, vy, left, rects = self.x, self.y, self.vx, self.vy, self.left, self.rects
+        fall = gravity * time
+        i = 0
+        while i < self.count:
+            left[i] -= time
+            if left[i] <= 0:
+                self.count -= 1
+                last = self.count
+                x[i], y[i], vx[i], vy[i], left[i] = x[last], y[last], vx[last], vy[last], left[last]
+                self.colors[i] = self.colors[last]
+                rects[i], rects[last] = rects[last], rects[i]
+                self.batch[i] = self.batch[last]
+                continue
+            vy[i] += fall
+            x[i] += vx[i] * time
+            y[i] += vy[i] * time
+            rect = rects[i]
+            rect.x = int(x[i])
+            rect.y = int(y[i])
+            i += 1
+
+    def draw(self, screen, tiles):
+        if not self.count:
+            return
+        if tiles is not self.tiles:
+            self.set_tiles(tiles)
+        screen.blits(self.batch, self.count)
+
+    def clear(self):
+        self.count = 0
@@ -0,0 +1,121 @@
+# Per-frame phase timing for the pyblocks main loop, licensed under GPLv3
+#
+# The main loop calls start_frame(), then mark(phase) at the end of every phase
+# and end_frame() last. Each frame's timings can be written to a CSV file, and
+# a small overlay shows the frame time percentiles on screen. A cProfile capture
+# can be started and stopped while the game runs.
+
+import time, atexit, cProfile
+from timeit import default_timer
+from textclasses import get_font
+
+phases = ["events", "collapse", "area", "block", "texts", "display"]
+
+class Null_profiler:
+    def start_frame(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def end_frame(self):
+        pass
+
+    def draw(self, screen):
+        pass
+
+    def toggle_hud(self):
+        pass
+
+    def toggle_capture(self):
+        pass
+
+class Frame_profiler(Null_profiler):
+    def __init__(self, font, csv_filename=None, budget=0.025, history=400):
+        self.font = get_font(font, 14)
+        self.budget = budget
+        self.history = history
+        self.frame_times = []
+        self.frames = 0
+        self.missed = 0
+        self.timings = dict((phase, 0.) for phase in phases)
+        self.hud_visible = True
+        self.hud_images = []
+        self.hud_refresh = 0.
+        self.profile = None
+
+        self.csv = None
+        if csv_filename is not None:
+            self.csv = open(csv_filename, 'w')
+            self.csv.write("frame,total_ms,%s,slowest\n" % ",".join(["%s_ms" % phase for phase in phases]))
+            atexit.register(self.close)
+
+    def start_frame(self):
+        for phase in phases:
+            self.timings[phase] = 0.
+        self.frame_start = self.last_mark = default_timer()
+
+    def mark(self, phase):
+        now = default_timer()
+        self.timings[phase] += now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        total = self.last_mark - self.frame_start
+        self.frames += 1
+        self.frame_times.append(total)
+        if len(self.frame_times) > self.history:
+            del self.frame_times[0]
+
+        slowest = max(phases, key=self.timings.get)
+        if total > self.budget:
+            self.missed += 1
+            print "Frame %d took %.1f ms, slowest phase: %s (%.1f ms)" % (self.frames, total * 1000, slowest, self.timings[slowest] * 1000)
+
+        if self.csv is not None:
+            self.csv.write("%d,%.3f,%s,%s\n" % (self.frames, total * 1000, ",".join(["%.3f" % (self.timings[phase] * 1000) for phase in phases]), slowest))
+
+    def percentile(self, times, fraction):
+        return times[min(len(times) - 1, int(fraction * len(times)))]
+
+    def draw(self, screen):
+        if not self.hud_visible or not self.frame_times:
+            return
+
+        # The text only changes twice a second, so it's not rendered every frame.
+        now = default_timer()
+        if now - self.hud_refresh > 0.5:
+            self.hud_refresh = now
+            times = sorted(self.frame_times)
+            lines = [
+                "frame ms p50 %.1f  p90 %.1f  p99 %.1f  max %.1f" % tuple([self.percentile(times, fraction) * 1000 for fraction in [0.5, 0.9, 0.99, 1.0]]),
+                "over %d ms budget: %d of %d frames" % (self.budget * 1000, self.missed, self.frames),
+                "  ".join(["%s %.1f" % (phase, self.timings[phase] * 1000) for phase in phases]),
+                ]
+            if self.profile is not None:
+                lines.append("cProfile capture running, F5 to stop")
+            self.hud_images = [self.font.render(line, 1, (255, 255, 0)) for line in lines]
+
+        for index, image in enumerate(self.hud_images):
+            screen.blit(image, (10, 520 + index * 16))
+
+    def toggle_hud(self):
+        self.hud_visible = not self.hud_visible
+
+    def toggle_capture(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            print "cProfile capture started."
+        else:
+            self.profile.disable()
+            filename = time.strftime("pyblocks-%Y%m%d-%H%M%S.pstats")
+            self.profile.dump_stats(filename)
+            self.profile = None
+            print "cProfile capture written to", filename
+        self.hud_refresh = 0.
+
+    def close(self):
+        if self.csv is not None:
+            self.csv.close()
+            self.csv = None
@@ -0,0 +1,122 @@
+# Recording and headless replaying of pyblocks games, licensed under GPLv3
+#
+# Usage: python replay.py [options] recording...
+# A recording is the seed of the game followed by every tick and key that
+# reached the GameState, each stamped with the number of fixed steps since the
+# start. A "tick" step moved the piece, a "wait" step only counted towards the
+# speed ramp while collapses were shown. Replaying feeds them to a fresh
+# GameState as fast as possible and checks that it ends up with the same board
+# and score as the recorded game.
+
+import sys, time, atexit
+from optparse import OptionParser
+from gamestate import GameState, tick_time
+
+header = "pyblocks recording 2"
+
+class Recorder:
+    def __init__(self, filename, state):
+        self.state = state
+        self.ticks = 0
+        self.file = None
+        if filename is None:
+            return
+
+        self.file = open(filename, 'w')
+        self.file.write(header + "\n")
+        self.file.write("seed %d\n" % state.seed)
+        self.file.write("size %d %d\n" % (state.board.x_edge, state.board.y_edge))
+        self.file.write("speed %r\n" % state.speed)
+        atexit.register(self.close)
+
+    def tick(self, moved):
+        self.ticks += 1
+        self.log(["wait", "tick"][moved])
+
+    def log(self, *event):
+        if self.file is not None:
+            self.file.write("%d %s\n" % (self.ticks, " ".join([str(item) for item in event])))
+
+    def close(self):
+        if self.file is None:
+            return
+
+        self.file.write("end %d %d %s\n" % (self.state.score, self.state.landings, board_string(self.state.board)))
+        self.file.close()
+        self.file = None
+
+def board_string(board):
+    return "/".join(["".join([str(color) for color in row]) for row in board.data[:-1]])
+
+class Recording:
+    def __init__(self, filename):
+        self.events = []
+        self.end = None
+
+        f = open(filename, 'r')
+        if f.readline().strip() != header:
+            raise ValueError("%s is not a pyblocks recording" % filename)
+
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == "seed":
+                self.seed = int(words[1])
+            elif words[0] == "size":
+                self.width, self.height = int(words[1]), int(words[2])
+            elif words[0] == "speed":
+                self.speed = float(words[1])
+            elif words[0] == "end":
+                self.end = (int(words[1]), int(words[2]), words[3])
+            else:
+                self.events.append((int(words[0]), words[1], words[2:]))
+        f.close()
+
+    def play(self):
+        state = GameState(self.seed, self.width, self.height, self.speed)
+        for stamp, name, args in self.events:
+            if name == "tick":
+                state.tick()
+                state.update(tick_time)
+            elif name == "wait":
+                state.tick()
+            elif name == "garbage":
+                state.add_garbage(int(args[0]))
+            elif name == "key":
+                state.press(args[0])
+        return state
+
+    def matches(self, state):
+        if self.end is None:
+            return None
+        return self.end == (state.score, state.landings, board_string(state.board))
+
+def main(argv=None):
+    parser = OptionParser(usage="python replay.py [options] recording...")
+    parser.add_option("-r", "--repeat", type="int", default=1, help="play every recording this many times")
+    options, args = parser.parse_args(argv)
+    if not args:
+        parser.error("no recordings given")
+
+    failed = False
+    for filename in args:
+        recording = Recording(filename)
+
+        start = time.time()
+        for i in range(options.repeat):
+            state = recording.play()
+        elapsed = time.time() - start
+
+        ticks = len([event for event in recording.events if event[1] in ["tick", "wait"]]) * options.repeat
+        result = {None: "no end state recorded", True: "matches", False: "DIFFERS"}[recording.matches(state)]
+        failed = failed or result == "DIFFERS"
+
+        print "%s: score %d, %d landings, %s" % (filename, state.score, state.landings, result)
+        print "  %d ticks in %.3f seconds, %.0f ticks/sec (%.0fx real time)" % (ticks, elapsed, ticks / max(elapsed, 1e-9), ticks * tick_time / max(elapsed, 1e-9))
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
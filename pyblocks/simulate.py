@@ -0,0 +1,132 @@
+# Plays complete games of pyblocks without a display, licensed under GPLv3
+#
+# Usage: python simulate.py [options]
+# Every game gets its own seed and runs in a pool of worker processes, one per
+# CPU core unless told otherwise. Run with --help for the options.
+
+import time, random
+import multiprocessing
+from optparse import OptionParser
+from ai import Player
+from highscores import Score_list
+from gamestate import GameState, base_speed, parse_size, classic_size, tick_rate, tick_time
+
+def random_policy(state, rng):
+    return rng.randrange(state.board.x_edge), rng.randrange(3)
+
+def lowest_policy(state, rng):
+    # Drops the piece into the emptiest column, leftmost first.
+    board = state.board
+    bottoms = [board.get_bottom(x) for x in range(board.x_edge)]
+    return bottoms.index(max(bottoms)), 0
+
+policies = {
+    "random": random_policy,
+    "lowest": lowest_policy,
+    "search": Player(lookahead=False),
+    "lookahead": Player(budget=None),
+    }
+
+def steer(state, column, rotation):
+    # Turns the current piece and moves it towards column as far as it goes.
+    piece = state.piece
+    for i in range(rotation):
+        state.rotate(1)
+    dir = [-1, 1][column > piece.x]
+    while piece.x != column:
+        x = piece.x
+        state.move(dir)
+        if piece.x == x:
+            break
+
+def play_game(args):
+    seed, policy_name, (width, height), speed, ramp_interval, max_time = args
+    policy = policies[policy_name]
+    rng = random.Random(seed)
+    state = GameState(seed, width, height, speed, int(round(ramp_interval * tick_rate)))
+
+    max_ticks = int(max_time * tick_rate)
+    piece = None
+    while not state.game_over and state.ticks < max_ticks:
+        if state.piece is not piece:
+            piece = state.piece
+            column, rotation = policy(state, rng)
+            steer(state, column, rotation)
+
+        state.accelerate()
+        state.tick()
+        state.update(tick_time)
+
+    return seed, state.score, state.landings, state.level, state.ticks * tick_time
+
+def percentile(values, fraction):
+    index = min(len(values) - 1, int(fraction * len(values)))
+    return values[index]
+
+def report(results, wall_time):
+    scores = sorted(score for seed, score, landings, level, elapsed in results)
+    landings = sum(landings for seed, score, landings, level, elapsed in results)
+    levels = sorted(level for seed, score, landings, level, elapsed in results)
+    games = len(results)
+
+    print "Games played:    %d in %.2f seconds" % (games, wall_time)
+    print "Games/sec:       %.1f" % (games / wall_time)
+    print "Landings/sec:    %.1f" % (landings / wall_time)
+    print "Landings/game:   %.1f" % (float(landings) / games)
+    print "Score mean:      %.1f" % (float(sum(scores)) / games)
+    print "Score min/max:   %d / %d" % (scores[0], scores[-1])
+    print "Score p10/50/90: %d / %d / %d" % (percentile(scores, 0.1), percentile(scores, 0.5), percentile(scores, 0.9))
+    print "Final PANIC p50/max: %d / %d" % (percentile(levels, 0.5), levels[-1])
+
+    buckets = {}
+    width = max(10, (scores[-1] - scores[0]) // 10 or 10)
+    for score in scores:
+        bucket = score // width * width
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    print "Score distribution:"
+    for bucket in sorted(buckets):
+        print "  %8d+ %6d %s" % (bucket, buckets[bucket], "#" * (60 * buckets[bucket] // games))
+
+def main(argv=None):
+    parser = OptionParser(usage="python simulate.py [options]")
+    parser.add_option("-n", "--games", type="int", default=1000, help="number of games to play")
+    parser.add_option("-j", "--processes", type="int", default=0, help="worker processes, 0 uses every core")
+    parser.add_option("--seed", type="int", default=0, help="seed of the first game, the rest count up from it")
+    parser.add_option("--policy", default="random", choices=sorted(policies.keys()), help="one of: %s" % ", ".join(sorted(policies.keys())))
+    parser.add_option("--board-size", default="%dx%d" % classic_size, metavar="WxH", help="board width and height in blocks")
+    parser.add_option("--speed", type="float", default=base_speed, help="starting block speed")
+    parser.add_option("--ramp", type="float", default=5., help="seconds between speed increases, 0 disables")
+    parser.add_option("--max-time", type="float", default=3600., help="simulated seconds before a game is stopped")
+    parser.add_option("--scores", metavar="FILE", help="add the scores to the high score list in FILE")
+    options, args = parser.parse_args(argv)
+    try:
+        size = parse_size(options.board_size)
+    except ValueError, error:
+        parser.error(str(error))
+
+    processes = options.processes or multiprocessing.cpu_count()
+    jobs = [(options.seed + i, options.policy, size, options.speed, options.ramp, options.max_time) for i in range(options.games)]
+
+    start = time.time()
+    if processes == 1:
+        results = map(play_game, jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        chunksize = max(1, len(jobs) // (processes * 8))
+        results = list(pool.imap_unordered(play_game, jobs, chunksize))
+        pool.close()
+        pool.join()
+    wall_time = time.time() - start
+
+    print "Policy: %s, board: %dx%d, processes: %d" % ((options.policy,) + size + (processes,))
+    report(results, wall_time)
+
+    if options.scores:
+        scores = Score_list(options.scores)
+        for seed, score, landings, level, elapsed in results:
+            scores.add(score, landings, seed, size, "sim-" + options.policy)
+        scores.close()
+        print "Scores added to", options.scores
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# Compact snapshots of a pyblocks game, licensed under GPLv3
+#
+# A snapshot packs the board, the colors of the current and the next piece and
+# the numbers of the game into a string of bytes with three bits per cell. Every
+# color is an octal digit, and the digits of the whole board are turned into
+# bytes in one go. Snapshots never change, so a clone costs nothing and they can
+# be compared and used as dictionary keys.
+#
+# The random generator that picks the colors isn't part of a snapshot. save()
+# writes it next to one, so that a resumed game goes on exactly as it would have.
+
+import os, struct, binascii
+from board import Board, colors
+from gamestate import GameState, Piece, min_size, max_size
+
+# width, height, score, landings, ticks, garbage, combo, speed, the speeds of
+# the current and the next piece, the position of the current piece and whether
+# it has touched down.
+header = struct.Struct("<HHiiIIHdddHdB")
+
+# The state of the random generator: its version, the 625 numbers of the
+# Mersenne Twister, whether a gauss() value is waiting and that value.
+random_state = struct.Struct("<i625IBd")
+
+save_header = "pyblocks save 1"
+
+def pack_digits(digits):
+    length = (len(digits) * 3 + 7) // 8
+    return binascii.unhexlify("%0*x" % (length * 2, int(digits, 8)))
+
+def unpack_digits(packed, count):
+    return ("%o" % int(binascii.hexlify(packed), 16)).zfill(count)
+
+class Snapshot:
+    def __init__(self, packed):
+        self.packed = packed
+
+    def __eq__(self, other):
+        return isinstance(other, Snapshot) and self.packed == other.packed
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.packed)
+
+    def __len__(self):
+        return len(self.packed)
+
+    def clone(self):
+        return self
+
+    def fields(self):
+        return header.unpack_from(self.packed)
+
+    def digits(self):
+        width, height = self.fields()[:2]
+        return unpack_digits(self.packed[header.size:], 6 + width * height)
+
+    def board(self):
+        fields = self.fields()
+        width, height, combo = fields[0], fields[1], fields[6]
+        digits = self.digits()
+        board = Board(width, height)
+        for y in range(height):
+            start = 6 + y * width
+            board.data[y] = map(int, digits[start:start + width])
+        board.hash = board.compute_hash()
+        board.combo = combo
+        return board
+
+def take(state):
+    board = state.board
+    piece, next_piece = state.piece, state.next_piece
+    digits = "".join([str(color) for color in piece.colors + next_piece.colors])
+    digits += "".join(["".join([str(color) for color in row]) for row in board.data[:-1]])
+    fields = header.pack(board.x_edge, board.y_edge, state.score, state.landings, state.ticks, state.garbage, board.combo,
+                         state.speed, piece.speed, next_piece.speed, piece.x, piece.y, piece.terminate)
+    return Snapshot(fields + pack_digits(digits))
+
+def restore(snapshot, seed=None):
+    # A GameState that carries on from the snapshot. Without the random generator
+    # from save() the colors of the pieces to come are picked anew from seed.
+    (width, height, score, landings, ticks, garbage, combo,
+     speed, piece_speed, next_speed, x, y, terminate) = snapshot.fields()
+    digits = snapshot.digits()
+
+    state = GameState(seed, width, height, speed)
+    state.board = snapshot.board()
+    state.score = score
+    state.landings = landings
+    state.ticks = ticks
+    state.garbage = garbage
+
+    state.piece = Piece([int(color) for color in digits[0:3]], x, y, piece_speed)
+    state.piece.terminate = bool(terminate)
+    state.retarget(state.piece)
+    state.next_piece = Piece([int(color) for color in digits[3:6]], state.spawn_x, 1, next_speed)
+    state.retarget(state.next_piece)
+    return state
+
+def save(filename, state):
+    snapshot = take(state)
+    f = open(filename + '.tmp', 'wb')
+    try:
+        f.write("%s\n%s\n" % (save_header, state.seed))
+        f.write(struct.pack("<I", len(snapshot)))
+        f.write(snapshot.packed)
+        version, internal, gauss = state.random.getstate()
+        f.write(random_state.pack(*((version,) + internal + (gauss is not None, gauss or 0.))))
+    finally:
+        f.close()
+
+    # The old save is only replaced once the new one has been written completely.
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(filename + '.tmp', filename)
+
+def resume(filename):
+    f = open(filename, 'rb')
+    try:
+        if f.readline().strip() != save_header:
+            raise ValueError("%s is not a pyblocks save" % filename)
+        seed = f.readline().strip()
+        if seed == "None":
+            seed = None
+        else:
+            seed = int(seed)
+        try:
+            length, = struct.unpack("<I", f.read(4))
+            snapshot = Snapshot(f.read(length))
+            fields = random_state.unpack(f.read(random_state.size))
+            width, height = snapshot.fields()[:2]
+        except struct.error:
+            raise ValueError("%s is damaged" % filename)
+    finally:
+        f.close()
+
+    # Only boards the game could have made, with exactly the bytes they take.
+    if not (min_size[0] <= width <= max_size[0] and min_size[1] <= height <= max_size[1]):
+        raise ValueError("%s is damaged" % filename)
+    if len(snapshot) != header.size + ((6 + width * height) * 3 + 7) // 8:
+        raise ValueError("%s is damaged" % filename)
+    if max(snapshot.digits()) > str(colors):
+        raise ValueError("%s is damaged" % filename)
+
+    gauss = None
+    if fields[626]:
+        gauss = fields[627]
+    state = restore(snapshot, seed)
+    state.random.setstate((fields[0], fields[1:626], gauss))
+    return state
@@ -3,19 +3,62 @@
 import pygame
 from pygame.locals import *
 from vector2 import Vector2
+from timeline import Tween
+from collections import OrderedDict
+
+# Fonts are shared by every text with the same file and size, so each font
+# file is only opened and parsed once.
+fonts = {}
+
+def get_font(font, size):
+    key = (font, size)
+    if key not in fonts:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        fonts[key] = pygame.font.Font(font, size)
+    return fonts[key]
+
+# Rendered strings are kept in a least recently used cache, so a score that
+# floats up again and again is only rendered the first time. The surfaces are
+# shared, nobody may draw on them.
+render_cache_size = 256
+render_cache = OrderedDict()
+
+def render_text(text, color, font, size, colorkeyed=False):
+    key = (text, color, font, size, colorkeyed)
+    try:
+        image = render_cache.pop(key)
+    except KeyError:
+        image = get_font(font, size).render(text, 1, color)
+        if colorkeyed:
+            keyed = pygame.surface.Surface(image.get_size())
+            keyed.set_colorkey(keyed.get_at((0,0)), RLEACCEL)
+            keyed.blit(image, (0,0))
+            image = keyed
+        if len(render_cache) >= render_cache_size:
+            render_cache.popitem(last=False)
+    render_cache[key] = image
+    return image
 
 class Text(pygame.sprite.Sprite, object):
     def __init__(self, coords, color, size, font):
         pygame.sprite.Sprite.__init__(self)
-        self.font = pygame.font.Font(font, size)
+        self.font_name = font
+        self.size = size
         self.x, self.y = coords
         self.color = color
 
-        self.image = self.font.render(self.as_string(), 1, self.color)
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (self.x,self.y)
+        # Nothing is rendered before the text is drawn for the first time.
+        self.image = None
+        self.rect = pygame.Rect(self.x, self.y, 0, 0)
+
+    def render(self):
+        self.image = render_text(self.as_string(), self.color, self.font_name, self.size)
+        self.rect.size = self.image.get_size()
 
     def update(self, screen):
+        if self.image is None:
+            self.render()
         screen.blit(self.image, self.rect)
         
     def as_string(self):
@@ -25,14 +68,21 @@ class Variabletext(Text):
     def __init__(self, coords, string, item, color, size, font, *args):
         self.string = string
         self.item = item
-        self.variables = ["self.item." + variable for variable in args]
+        self.variables = args
+        self.values = self.get_values()
         Text.__init__(self, coords, color, size, font)
         
+    def get_values(self):
+        return tuple([getattr(self.item, variable) for variable in self.variables])
+
     def as_string(self):
-        return self.string % (tuple(map(eval, self.variables)))
+        return self.string % self.values
     
     def update(self, screen):
-        self.image = self.font.render(self.as_string(), 1, self.color)
+        values = self.get_values()
+        if values != self.values or self.image is None:
+            self.values = values
+            self.render()
         screen.blit(self.image, self.rect)
 
 class Simpletext(Text):
@@ -42,17 +92,24 @@ class Simpletext(Text):
 
 class Vanishingtext(Text):
     def __init__(self, coords, phrase, color, size, font, time):
-        self.phrase = phrase    
+        Text.__init__(self, coords, color, size, font)
+        self.reset(coords, phrase, color, size, font, time)
+        
+    def reset(self, coords, phrase, color, size, font, time):
+        # Turns a finished text into a new one, see Floating_texts.
+        self.phrase = phrase
+        self.color, self.size, self.font_name = color, size, font
+        self.x, self.y = coords
         self.visible_time = time
         self.elapsed_time = 0
         self.timeout = False
-        Text.__init__(self, coords, color, size, font)
+        self.image = None
         
     def update(self, screen, time):
         self.elapsed_time += time
         if self.elapsed_time < self.visible_time:
-            self.image = self.font.render(self.as_string(), 1, self.color)
-            self.rect = self.image.get_rect()
+            if self.image is None:
+                self.render()
             self.rect.topleft = (self.x,self.y)
             screen.blit(self.image, self.rect)
         else:
@@ -61,46 +118,117 @@ class Vanishingtext(Text):
 class Movingtext(pygame.sprite.Sprite, object):
     def __init__(self, coords, phrase, color, size, font, heading, speed, time):
         pygame.sprite.Sprite.__init__(self)
-        self.font = pygame.font.Font(font, size)
+        self.pos = Vector2(coords)
+        self.start = Vector2(coords)
+        self.reset(coords, phrase, color, size, font, heading, speed, time)
         
+    def reset(self, coords, phrase, color, size, font, heading, speed, time):
+        # Turns a finished text into a new one, see Floating_texts. The surface
+        # comes from the render cache and is shared with every other text that
+        # shows the same string.
         self.color = color
         self.phrase = str(phrase)
         self.heading = heading
         self.speed = speed
-        self.pos = Vector2(coords)
         
         #self.dropshadow = self.font.render(self.phrase, 1, (1,1,1))
-        self.text = self.font.render(self.phrase, 1, self.color)
-        
-        self.image = pygame.surface.Surface(self.text.get_size())
+        self.image = render_text(self.phrase, self.color, font, size, colorkeyed=True)
         self.rect = self.image.get_rect()
-        
-        colorkey = self.image.get_at((0,0))
-        self.image.set_colorkey(colorkey, RLEACCEL)
-        
-        #self.image.blit(self.dropshadow, (3,3))
-        self.image.blit(self.text, (0,0))
+        self.move_to(coords)
 
         self.elapsed_time = 0
+        self.timeout = False
         
         if time != -1:
             self.visible_time = time
-            self.timeout = False
             self.usetimer = True
+            self.motion = Tween(time, 0., self.speed * time)
         else:
             self.visible_time = 1
             self.usetimer = False
             
+    def move_to(self, (x, y)):
+        self.pos.set(x, y)
+        self.start.set(x, y)
+        self.rect.topleft = (x, y)
+            
     def update(self, screen, time=0):
         if self.usetimer:
             self.elapsed_time += time
             
         if self.elapsed_time < self.visible_time:
             
-            self.pos += self.heading * self.speed * time
-            self.rect.topleft = self.pos.as_tuple()
+            # The position is updated in place, no vectors are created per frame.
+            if self.usetimer:
+                self.pos.set(self.start.x, self.start.y)
+                self.pos.add_scaled(self.heading, self.motion.update(time))
+            else:
+                self.pos.add_scaled(self.heading, self.speed * time)
+            self.rect.left = self.pos.x
+            self.rect.top = self.pos.y
             screen.blit(self.image, self.rect)
             
         else:
             self.timeout = True
-            
\ No newline at end of file
+
+class Floating_texts:
+    # Texts that show for a while and go away by themselves. A finished text goes
+    # back to a pool and add() makes a new one out of it, so long combo chains
+    # don't keep creating texts. update() draws the live texts and drops the
+    # finished ones in the same pass. With bounds, a new text is kept inside them
+    # sideways and moved up past the texts it would cover. All the texts move the
+    # same way, so they stay apart from then on.
+    def __init__(self, kind, bounds=None, pool_size=64):
+        self.kind = kind
+        self.bounds = bounds
+        self.pool_size = pool_size
+        self.live = []
+        self.free = []
+        
+    def __len__(self):
+        return len(self.live)
+    
+    def __iter__(self):
+        return iter(self.live)
+    
+    def add(self, *args):
+        if self.free:
+            text = self.free.pop()
+            text.reset(*args)
+        else:
+            text = self.kind(*args)
+        if self.bounds is not None:
+            self.place(text)
+        self.live.append(text)
+        return text
+    
+    def place(self, text):
+        rect = text.rect
+        if rect.right > self.bounds.right:
+            rect.right = self.bounds.right
+        if rect.left < self.bounds.left:
+            rect.left = self.bounds.left
+        
+        # Every move takes the text above the one it covered, so it can't cover
+        # that one again and the loop ends.
+        moved = True
+        while moved:
+            moved = False
+            for other in self.live:
+                if rect.colliderect(other.rect):
+                    rect.bottom = other.rect.top - 1
+                    moved = True
+        text.move_to(rect.topleft)
+    
+    def update(self, screen, time):
+        live = self.live
+        kept = 0
+        for text in live:
+            text.update(screen, time)
+            if text.timeout:
+                if len(self.free) < self.pool_size:
+                    self.free.append(text)
+            else:
+                live[kept] = text
+                kept += 1
+        del live[kept:]
@@ -0,0 +1,61 @@
+# Time based animation helpers for pyblocks, licensed under GPLv3
+#
+# Nothing in here waits or draws. Everything is advanced by calling update()
+# with the time passed since the previous frame, once per tick of the main loop.
+
+class Tween:
+    def __init__(self, duration, start, end, setter=None):
+        self.duration = duration
+        self.start = start
+        self.change = end - start
+        self.setter = setter
+        self.elapsed = 0.
+        self.value = start
+        self.done = False
+
+    def update(self, time):
+        self.elapsed += time
+        if self.elapsed >= self.duration:
+            self.elapsed = self.duration
+            self.done = True
+
+        if self.duration > 0:
+            self.value = self.start + self.change * (self.elapsed / self.duration)
+        else:
+            self.value = self.start + self.change
+
+        if self.setter is not None:
+            self.setter(self.value)
+        return self.value
+
+class Timeline:
+    def __init__(self):
+        self.queue = []
+        self.tweens = []
+        self.wait = 0.
+
+    def add(self, tween):
+        # Tweens run side by side until they're done.
+        self.tweens.append(tween)
+
+    def then(self, action, delay=0.):
+        # Actions run one after another, each delay seconds after the previous one.
+        self.queue.append((action, delay))
+
+    def busy(self):
+        return bool(self.queue) or self.wait > 0
+
+    def update(self, time):
+        if self.tweens:
+            for tween in self.tweens:
+                tween.update(time)
+            self.tweens = [tween for tween in self.tweens if not tween.done]
+
+        self.wait -= time
+        while self.wait <= 0 and self.queue:
+            action, delay = self.queue.pop(0)
+            action()
+            self.wait += delay
+
+        if self.wait < 0:
+            self.wait = 0.
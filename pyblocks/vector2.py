@@ -94,6 +94,25 @@ class Vector2(object):
         return v
 
 
+    def set(self, x, y):
+        """Sets both components in place, without creating a new vector."""
+        v = self._v
+        v[0] = x
+        v[1] = y
+        return self
+
+    def add_scaled(self, rhs, scale):
+        """Adds rhs multiplied by a scalar to this vector in place, the
+        same as self += rhs * scale without the temporary vector."""
+        if rhs.__class__ is Vector2:
+            xx, yy = rhs._v
+        else:
+            xx, yy = rhs
+        v = self._v
+        v[0] += xx * scale
+        v[1] += yy * scale
+        return self
+
     def copy(self):
         """Returns a copy of this object."""
         vec = self.__new__(self.__class__, object)
@@ -133,7 +152,7 @@ class Vector2(object):
 
     def __iter__(self):
 
-        return iter(self._v[:])
+        return iter(self._v)
 
     def __len__(self):
 
@@ -179,7 +198,10 @@ class Vector2(object):
 
 
     def __iadd__(self, rhs):
-        xx, yy = rhs
+        if rhs.__class__ is Vector2:
+            xx, yy = rhs._v
+        else:
+            xx, yy = rhs
         v = self._v
         v[0] += xx
         v[1] += yy
@@ -200,9 +222,12 @@ class Vector2(object):
         xx, yy = lhs
         return self.from_floats(xx-x, yy-y)
 
-    def _isub__(self, rhs):
+    def __isub__(self, rhs):
 
-        xx, yy = rhs
+        if rhs.__class__ is Vector2:
+            xx, yy = rhs._v
+        else:
+            xx, yy = rhs
         v = self._v
         v[0] -= xx
         v[1] -= yy
@@ -221,7 +246,12 @@ class Vector2(object):
 
     def __imul__(self, rhs):
         """Multiplys this vector with a scalar or a vector-list object."""
-        if hasattr(rhs, "__getitem__"):
+        if rhs.__class__ is Vector2:
+            xx, yy = rhs._v
+            v = self._v
+            v[0] *= xx
+            v[1] *= yy
+        elif hasattr(rhs, "__getitem__"):
             xx, yy = rhs
             v = self._v
             v[0] *= xx
@@ -255,7 +285,12 @@ class Vector2(object):
 
     def __idiv__(self, rhs):
         """Divides this vector with a scalar or a vector-list object."""
-        if hasattr(rhs, "__getitem__"):
+        if rhs.__class__ is Vector2:
+            xx, yy = rhs._v
+            v = self._v
+            v[0] /= xx
+            v[1] /= yy
+        elif hasattr(rhs, "__getitem__"):
             xx, yy = rhs
             v = self._v
             v[0] /= xx